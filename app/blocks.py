@@ -0,0 +1,165 @@
+import re
+import numpy as np
+
+# Columnar text blocks. A page's blocks are held as parallel float64 arrays
+# (size and geometry) plus a list of texts, so sorting, merging and the
+# geometric filters are whole-array operations; block dicts (the form the
+# candidates, page cache and shards exchange) are built once a page is merged.
+
+FOOTER_PATTERNS = [
+    r"Page \d+ of \d+",
+    r"Page \d+",
+    r"Version \d{4}",
+    r"© .+",
+    r"\d{4}-\d{2}-\d{2}",
+    r"\d{1,2}/\d{1,2}/\d{4}",
+    r"Copyright",
+    r"Confidential"
+]
+FOOTER_RE = re.compile("|".join(f"(?:{pattern})" for pattern in FOOTER_PATTERNS))
+
+# Numbered-heading prefixes; they are mutually exclusive, so one match decides.
+LEVEL_RE = re.compile(r"(?P<H1>\d+\.\s+)|(?P<H2>\d+\.\d+\s+)|(?P<H3>\d+\.\d+\.\d+\s+)")
+
+_FIELDS = ('size', 'x0', 'top', 'x1', 'bottom')
+
+
+class BlockTable:
+    __slots__ = ('text',) + _FIELDS
+
+    def __init__(self, text, size, x0, top, x1, bottom):
+        self.text = text
+        self.size = size
+        self.x0 = x0
+        self.top = top
+        self.x1 = x1
+        self.bottom = bottom
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        columns = [np.array([b[field] for b in blocks], dtype=np.float64) for field in _FIELDS]
+        return cls([b['text'] for b in blocks], *columns)
+
+    def __len__(self):
+        return len(self.text)
+
+    def block(self, i):
+        return {
+            'text': self.text[i],
+            'size': float(self.size[i]),
+            'x0': float(self.x0[i]),
+            'top': float(self.top[i]),
+            'x1': float(self.x1[i]),
+            'bottom': float(self.bottom[i])
+        }
+
+    def to_blocks(self):
+        columns = [getattr(self, field).tolist() for field in _FIELDS]
+        return [dict(zip(('text',) + _FIELDS, row)) for row in zip(self.text, *columns)]
+
+    def take(self, index):
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        return BlockTable([self.text[i] for i in index.tolist()],
+                          *(getattr(self, field)[index] for field in _FIELDS))
+
+    def reading_order(self):
+        """Blocks sorted by (top, x0); ties keep their current order."""
+        order = np.lexsort((self.x0, self.top))
+        if (order[1:] > order[:-1]).all():
+            return self
+        return self.take(order)
+
+    def merge_continuous(self, gap_threshold=10):
+        """Join runs of consecutive blocks into one block each.
+
+        A block joins the run when its gap to the previous block is below
+        `gap_threshold` and its size is within 0.1 of the run's first block.
+        The merged block keeps the first block's size, x0 and top, the last
+        block's bottom and the widest x1, and joins the texts with spaces.
+        """
+        n = len(self)
+        if n < 2:
+            return self
+        gap_break = np.empty(n, dtype=bool)
+        gap_break[0] = True
+        gap_break[1:] = ~(self.top[1:] - self.bottom[:-1] < gap_threshold)
+        heads = np.flatnonzero(gap_break)
+        in_size = np.abs(self.size - self.size[heads[np.cumsum(gap_break) - 1]]) < 0.1
+
+        if not in_size.all():
+            # Runs whose sizes drift from the first block split sequentially.
+            run_starts = heads.tolist()
+            split = set(run_starts)
+            for start, end in zip(run_starts, run_starts[1:] + [n]):
+                if in_size[start:end].all():
+                    continue
+                head = start
+                for j in range(start + 1, end):
+                    if not abs(self.size[head] - self.size[j]) < 0.1:
+                        head = j
+                        split.add(j)
+            heads = np.array(sorted(split))
+
+        starts = heads.tolist()
+        ends = starts[1:] + [n]
+        last = np.array(ends) - 1
+        return BlockTable([' '.join(self.text[s:e]) for s, e in zip(starts, ends)],
+                          self.size[heads], self.x0[heads], self.top[heads],
+                          np.maximum.reduceat(self.x1, heads), self.bottom[last])
+
+    def header_footer_mask(self, page_height):
+        return (self.top < page_height * 0.05) | (self.bottom > page_height * 0.9)
+
+
+# ─── Text statistics ─────────────────────────────────────────────────────────
+_BMP = 0x10000
+_CLASS_TABLES = None
+
+
+def _class_tables():
+    """Upper-case / digit / punctuation flags for every BMP code point, built once."""
+    global _CLASS_TABLES
+    if _CLASS_TABLES is None:
+        chars = [chr(c) for c in range(_BMP)]
+        upper = np.fromiter((c.isupper() for c in chars), dtype=bool, count=_BMP)
+        digit = np.fromiter((c.isdigit() for c in chars), dtype=bool, count=_BMP)
+        punct = np.zeros(_BMP, dtype=bool)
+        punct[[ord(c) for c in '.,;:!?']] = True
+        _CLASS_TABLES = upper, digit, punct
+    return _CLASS_TABLES
+
+
+def text_stats(texts):
+    """(length, upper-case count, digit count, has punctuation) arrays for `texts`.
+
+    All texts are decoded to one UTF-32 code-point array and classified with
+    lookup tables; code points beyond the BMP fall back to str methods. Lone
+    surrogates (left by some PDF text extraction) are kept as their own code points.
+    """
+    n = len(texts)
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=n)
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    upper_table, digit_table, punct_table = _class_tables()
+
+    bmp = codes < _BMP
+    if bmp.all():
+        upper, digit, punct = upper_table[codes], digit_table[codes], punct_table[codes]
+    else:
+        upper = np.zeros(len(codes), dtype=bool)
+        digit = np.zeros(len(codes), dtype=bool)
+        punct = np.zeros(len(codes), dtype=bool)
+        upper[bmp], digit[bmp], punct[bmp] = (upper_table[codes[bmp]], digit_table[codes[bmp]],
+                                              punct_table[codes[bmp]])
+        for i in np.flatnonzero(~bmp).tolist():
+            c = chr(codes[i])
+            upper[i], digit[i] = c.isupper(), c.isdigit()
+
+    owner = np.repeat(np.arange(n), lengths)
+    return (
+        lengths,
+        np.bincount(owner, weights=upper, minlength=n),
+        np.bincount(owner, weights=digit, minlength=n),
+        np.bincount(owner, weights=punct, minlength=n) > 0
+    )
@@ -0,0 +1,114 @@
+import os
+from pdfminer.pdftypes import PDFObjRef, resolve1
+from pdfminer.psparser import PSLiteral
+from pdfminer.utils import decode_text
+
+# Outline from the PDF's own /Outlines bookmarks. When a document carries a
+# usable bookmark tree, its titles, depths and destinations are the outline
+# and the heading classifier does not need to run at all.
+
+LEVELS = ('H1', 'H2', 'H3')
+# An outline is used only with at least this many entries ...
+MIN_BOOKMARKS = 3
+# ... at least one per this many pages ...
+MAX_PAGES_PER_BOOKMARK = 20
+# ... and this share of its entries pointing at a page of the document.
+MIN_RESOLVED = 0.8
+
+
+def bookmarks_enabled():
+    return os.getenv('BOOKMARKS', '1') != '0'
+
+
+def _name(value):
+    if isinstance(value, PSLiteral):
+        return value.name
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return value
+
+
+def _walk(outlines):
+    """(depth, title, dest, action) of every outline item, in document order.
+
+    Iterative, since /Next chains can be thousands long, and each item is
+    visited once even if the tree links back on itself.
+    """
+    seen = set()
+    stack = [(outlines.get('First'), 1)] if isinstance(outlines, dict) else []
+    while stack:
+        ref, depth = stack.pop()
+        if isinstance(ref, PDFObjRef):
+            if ref.objid in seen:
+                continue
+            seen.add(ref.objid)
+        item = resolve1(ref)
+        if not isinstance(item, dict):
+            continue
+        if 'Next' in item:
+            stack.append((item['Next'], depth))
+        if 'First' in item:
+            stack.append((item['First'], depth + 1))
+        title = resolve1(item.get('Title'))
+        if isinstance(title, bytes):
+            title = decode_text(title)
+        if isinstance(title, str):
+            yield depth, title, item.get('Dest'), item.get('A')
+
+
+def _dest_page(doc, dest, action, page_numbers):
+    """1-based page number an outline item points at, or None."""
+    if dest is None and action is not None:
+        action = resolve1(action)
+        if not isinstance(action, dict) or _name(resolve1(action.get('S'))) != 'GoTo':
+            return None
+        dest = action.get('D')
+    dest = resolve1(dest)
+    if isinstance(dest, (str, bytes, PSLiteral)):
+        try:
+            dest = resolve1(doc.get_dest(_name(dest) if isinstance(dest, PSLiteral) else dest))
+        except Exception:
+            return None
+    if isinstance(dest, dict):
+        dest = resolve1(dest.get('D'))
+    if not isinstance(dest, list) or not dest:
+        return None
+    target = dest[0]
+    if isinstance(target, PDFObjRef):
+        return page_numbers.get(target.objid)
+    if isinstance(target, int) and 0 <= target < len(page_numbers):
+        return target + 1
+    return None
+
+
+def read_bookmarks(pdf):
+    """Outline entries from an open pdfplumber PDF's bookmarks, or None.
+
+    None means there are no bookmarks or they are too few, or too many of
+    them do not resolve to a page; the caller then extracts the outline
+    from the page contents.
+    """
+    doc = pdf.doc
+    try:
+        outlines = resolve1(doc.catalog.get('Outlines'))
+        if not isinstance(outlines, dict):
+            return None
+        page_numbers = {page.page_obj.pageid: page_num for page_num, page in enumerate(pdf.pages, 1)}
+        items = 0
+        outline = []
+        for depth, title, dest, action in _walk(outlines):
+            text = title.strip()
+            if not text:
+                continue
+            items += 1
+            page_num = _dest_page(doc, dest, action, page_numbers)
+            if page_num is not None:
+                outline.append({"level": LEVELS[min(depth, len(LEVELS)) - 1], "text": text, "page": page_num})
+    except Exception:
+        return None
+
+    if (len(outline) < MIN_BOOKMARKS
+            or len(outline) * MAX_PAGES_PER_BOOKMARK < len(pdf.pages)
+            or len(outline) < MIN_RESOLVED * items):
+        return None
+    return outline
@@ -0,0 +1,55 @@
+import os
+import sys
+import argparse
+import pdfplumber
+from pathlib import Path
+from utils import load_models, extract_features_batch
+from main import collect_candidates
+
+# Compares classifier_head decisions of the int8 MiniLM against the float32 path
+# on every candidate block of the PDFs in the input directory.
+
+
+def compare(pdf_path, float_models, int8_models):
+    with pdfplumber.open(pdf_path) as pdf:
+        _, body_size, candidates = collect_candidates(pdf)
+    if not candidates:
+        return 0, []
+
+    float_pred = float_models['classifier_head'].predict(
+        extract_features_batch(candidates, body_size, float_models))
+    int8_pred = int8_models['classifier_head'].predict(
+        extract_features_batch(candidates, body_size, int8_models))
+
+    flipped = [
+        (c['page'], c['block']['text'].strip(), bool(f), bool(q))
+        for c, f, q in zip(candidates, float_pred, int8_pred) if f != q
+    ]
+    return len(candidates), flipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check int8 MiniLM decisions against float32.")
+    parser.add_argument('--input-dir', default='app/input')
+    parser.add_argument('--min-agreement', type=float, default=0.99)
+    args = parser.parse_args()
+
+    model_dir = Path(os.getenv('MODEL_DIR', 'app/models'))
+    float_models = load_models(model_dir, int8=False)
+    int8_models = load_models(model_dir, int8=True)
+
+    total = 0
+    total_flipped = 0
+    for filename in sorted(os.listdir(args.input_dir)):
+        if not filename.lower().endswith('.pdf'):
+            continue
+        n, flipped = compare(os.path.join(args.input_dir, filename), float_models, int8_models)
+        total += n
+        total_flipped += len(flipped)
+        print(f"{filename}: {n} candidates, {len(flipped)} decisions differ")
+        for page, text, f, q in flipped:
+            print(f"  p{page} float32={f} int8={q} {text[:80]!r}")
+
+    agreement = 1 - total_flipped / total if total else 1.0
+    print(f"Agreement: {agreement:.4f} over {total} candidate blocks")
+    sys.exit(0 if agreement >= args.min_agreement else 1)
@@ -0,0 +1,190 @@
+import os
+import json
+import numpy as np
+
+# Plain-NumPy model bundle exported by train_model.py. Every array is a separate
+# .npy file so it can be memory-mapped; loading it needs neither sklearn nor joblib.
+
+_TREE_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'max_depth')
+
+
+def flatten_forest(forest):
+    """Concatenate the trees of a fitted sklearn forest into flat node arrays.
+
+    Child indices are global (offset by each tree's first node); leaves have
+    left == right == -1. Leaf values are normalized class fractions.
+    """
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        max_depth = max(max_depth, tree.max_depth)
+        is_leaf = tree.children_left == -1
+        roots.append(offset)
+        feature.append(np.where(is_leaf, -1, tree.feature))
+        threshold.append(tree.threshold)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        counts = tree.value[:, 0, :]
+        value.append(counts / np.maximum(counts.sum(axis=1, keepdims=True), 1e-12))
+        offset += tree.node_count
+
+    return {
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'value': np.concatenate(value).astype(np.float64),
+        'roots': np.array(roots, dtype=np.int32),
+        'max_depth': np.array(max_depth, dtype=np.int32)
+    }
+
+
+def export_bundle(bundle_dir, pca, forests, cascade=None):
+    """Write PCA and forests (name -> fitted classifier) as .npy files plus meta.json."""
+    os.makedirs(bundle_dir, exist_ok=True)
+    meta = {'pca': {'whiten': bool(pca.whiten)}, 'forests': {}}
+
+    np.save(os.path.join(bundle_dir, 'pca_mean.npy'), pca.mean_)
+    np.save(os.path.join(bundle_dir, 'pca_components.npy'), pca.components_)
+    if pca.whiten:
+        np.save(os.path.join(bundle_dir, 'pca_scale.npy'), np.sqrt(pca.explained_variance_))
+
+    if cascade is not None:
+        forests = dict(forests, classifier_struct=cascade['model'])
+        meta['cascade'] = {'low': float(cascade['low']), 'high': float(cascade['high'])}
+
+    for name, forest in forests.items():
+        for key, array in flatten_forest(forest).items():
+            np.save(os.path.join(bundle_dir, f"{name}_{key}.npy"), array)
+        meta['forests'][name] = {'classes': forest.classes_.tolist()}
+
+    with open(os.path.join(bundle_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+class CompiledPCA:
+    def __init__(self, mean, components, scale=None):
+        self.mean = mean
+        self.components = components
+        self.scale = scale
+
+    def transform(self, X):
+        X_transformed = (np.asarray(X, dtype=np.float64) - self.mean) @ self.components.T
+        if self.scale is not None:
+            X_transformed /= self.scale
+        return X_transformed
+
+
+class FusedProjection:
+    """PCA folded into a single float32 affine map: x @ weight + bias.
+
+    Rows of `weight` follow the feature layout, structural features first and
+    then the embedding, so both parts are written straight into one float32
+    buffer and a whole batch is projected with one GEMM.
+    """
+
+    def __init__(self, mean, components, scale=None, n_struct=10):
+        weight = np.asarray(components, dtype=np.float64).T
+        if scale is not None:
+            weight = weight / np.asarray(scale, dtype=np.float64)
+        self.weight = np.ascontiguousarray(weight, dtype=np.float32)
+        self.bias = (-np.asarray(mean, dtype=np.float64) @ weight).astype(np.float32)
+        self.n_struct = n_struct
+
+    @classmethod
+    def from_pca(cls, pca, n_struct=10):
+        """Build from a fitted sklearn PCA or a CompiledPCA."""
+        if isinstance(pca, CompiledPCA):
+            return cls(pca.mean, pca.components, pca.scale, n_struct)
+        scale = np.sqrt(pca.explained_variance_) if pca.whiten else None
+        return cls(pca.mean_, pca.components_, scale, n_struct)
+
+    def project(self, structural, embeddings):
+        features = np.empty((len(structural), self.weight.shape[0]), dtype=np.float32)
+        features[:, :self.n_struct] = structural
+        features[:, self.n_struct:] = embeddings
+        projected = features @ self.weight
+        projected += self.bias
+        return projected
+
+
+class CompiledForest:
+    """Evaluates a flattened forest with the same decisions as sklearn's predict.
+
+    All trees are walked together: each step advances a (rows x trees) matrix
+    of node indices by one level, so a batch costs at most max_depth
+    vectorized steps regardless of the number of trees.
+    """
+
+    def __init__(self, arrays, classes, chunk_rows=1024):
+        # Leaves point to themselves and test feature 0 against +inf, so every
+        # row can take a step on every tree without masking finished walks.
+        is_leaf = np.asarray(arrays['feature']) < 0
+        nodes = np.arange(len(is_leaf), dtype=np.int64)
+        self.feature = np.where(is_leaf, 0, arrays['feature']).astype(np.int64)
+        self.threshold = np.where(is_leaf, np.inf, arrays['threshold'])
+        self.left = np.where(is_leaf, nodes, arrays['left'])
+        self.right = np.where(is_leaf, nodes, arrays['right'])
+        self.value = arrays['value']
+        self.roots = np.asarray(arrays['roots'], dtype=np.int64)
+        self.max_depth = int(arrays['max_depth'])
+        self.classes_ = np.array(classes)
+        self.chunk_rows = chunk_rows
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        return cls(flatten_forest(forest), forest.classes_)
+
+    def _leaves(self, X):
+        flat = X.ravel()
+        offsets = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_left = flat.take(offsets + self.feature.take(node)) <= self.threshold.take(node)
+            node = np.where(go_left, self.left.take(node), self.right.take(node))
+        return node
+
+    def predict_proba(self, X):
+        # sklearn compares float32 inputs against the float64 thresholds.
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32), dtype=np.float64)
+        proba = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), self.chunk_rows):
+            leaves = self._leaves(X[start:start + self.chunk_rows])
+            proba[start:start + self.chunk_rows] = self.value.take(leaves, axis=0).mean(axis=1)
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def verify_forest(compiled, forest, X):
+    """Raise if the compiled forest's decisions differ from sklearn's on X."""
+    mismatched = int(np.sum(compiled.predict(X) != forest.predict(X)))
+    if mismatched:
+        raise ValueError(f"compiled forest disagrees with sklearn on {mismatched}/{len(X)} rows")
+
+
+class Bundle:
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        with open(os.path.join(bundle_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def _load(self, name):
+        return np.load(os.path.join(self.bundle_dir, f"{name}.npy"), mmap_mode='r')
+
+    def has(self, name):
+        return name in self.meta['forests']
+
+    def pca(self):
+        scale = self._load('pca_scale') if self.meta['pca']['whiten'] else None
+        return CompiledPCA(self._load('pca_mean'), self._load('pca_components'), scale)
+
+    def forest(self, name):
+        arrays = {key: self._load(f"{name}_{key}") for key in _TREE_ARRAYS}
+        return CompiledForest(arrays, self.meta['forests'][name]['classes'])
+
+    def cascade(self):
+        return dict(self.meta['cascade'], model=self.forest('classifier_struct'))
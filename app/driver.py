@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import multiprocessing as mp
+from collections import Counter, deque
+from functools import partial
+from multiprocessing.connection import wait
+from utils import load_models, model_fingerprint, write_json_atomic
+from main import process_pdf, replay_ndjson, stream_pdf
+from sharding import process_pdf_sharded
+from incremental import Manifest, extractor_settings, file_sha256, process_pdf_incremental
+from instrument import NULL_PROFILER, Profiler, profiling_enabled, summarize
+from threads import apply_thread_budget, thread_budget
+
+# Models loaded by the parent before forking; workers inherit them copy-on-write.
+_MODELS = None
+PIPELINE_MODELS = ('minilm', 'projection', 'classifier_head', 'classifier_struct')
+
+
+def _process_one(pdf_path, output_path, models, options, pool=None):
+    start = time.perf_counter()
+    stats = Counter()
+    profile = options.get('profile')
+    profiler = Profiler() if profile else NULL_PROFILER
+    report = None
+    try:
+        ndjson = options.get('ndjson')
+        if options.get('cache_dir') and not ndjson:
+            cache_path = os.path.join(options['cache_dir'], os.path.basename(pdf_path) + '.pages.json')
+            result = process_pdf_incremental(pdf_path, models, cache_path, options['cache_version'],
+                                             stats, profiler, pool, options.get('shards', 1),
+                                             options.get('batch_pages'))
+        elif ndjson == '-':
+            result = stream_pdf(pdf_path, models, sys.stdout, stats, profiler)
+        elif ndjson:
+            with open(ndjson_path(output_path), 'w') as out:
+                result = stream_pdf(pdf_path, models, out, stats, profiler)
+        elif pool is not None:
+            result = process_pdf_sharded(pdf_path, models, pool, options['shards'],
+                                         options.get('batch_pages'), stats, profiler)
+        else:
+            result = process_pdf(pdf_path, models, options.get('batch_pages'), stats, profiler)
+        write_json_atomic(output_path, result)
+        if profile:
+            report = profiler.report(stats)
+            write_json_atomic(sidecar_path(output_path), report)
+        error = None
+    except Exception as e:
+        error = repr(e)
+    return pdf_path, error, time.perf_counter() - start, dict(stats), report
+
+
+def outline_source(stats):
+    """'bookmarks' if the outline came from the PDF's own bookmarks, else 'model'."""
+    return 'bookmarks' if stats.get('bookmark_outlines') else 'model'
+
+
+def sidecar_path(output_path):
+    return os.path.splitext(output_path)[0] + '.profile.json'
+
+
+def ndjson_path(output_path):
+    return os.path.splitext(output_path)[0] + '.ndjson'
+
+
+def _replay(pdf_path, output_path, ndjson):
+    """Stream the records of an unchanged file from its existing output."""
+    with open(output_path) as f:
+        result = json.load(f)
+    if ndjson == '-':
+        replay_ndjson(pdf_path, result, sys.stdout)
+    else:
+        with open(ndjson_path(output_path), 'w') as out:
+            replay_ndjson(pdf_path, result, out)
+
+
+def _worker(conn, model_dir, options):
+    if _MODELS is not None:
+        apply_thread_budget(options['threads'])
+        models = _MODELS
+    else:
+        models = load_models(model_dir, threads=options['threads'])
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        conn.send(_process_one(*task, models, options))
+        if not conn.poll():
+            # Out of work for now; persist the embedding cache while idle.
+            _flush_cache(models)
+    _flush_cache(models)
+
+
+class WorkerPool:
+    """Worker processes running `_worker`, each connected to the parent by its own pipe.
+
+    The parent knows which tasks every worker holds, so a worker that dies
+    (OOM kill, segfault, a crash while loading the models) fails only the
+    task it was running, and the tasks still queued for it go to a new worker.
+    Results are sent synchronously, so none is lost when a worker dies right
+    after finishing a file. With the fork start method the workers share
+    `models` (loaded here if not given) copy-on-write.
+    """
+
+    def __init__(self, workers, model_dir, options, depth=1, models=None):
+        global _MODELS
+        self.ctx = mp.get_context()
+        if self.ctx.get_start_method() == 'fork':
+            if models is None:
+                models = load_models(model_dir, threads=options['threads']).preload(*PIPELINE_MODELS)
+            _MODELS = models
+        self.model_dir = model_dir
+        self.options = options
+        self.depth = depth
+        self.procs = [None] * workers
+        self.conns = [None] * workers
+        self.assigned = [deque() for _ in range(workers)]
+        for index in range(workers):
+            self._spawn(index)
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self.ctx.Pipe()
+        proc = self.ctx.Process(target=_worker, args=(child_conn, self.model_dir, self.options))
+        proc.start()
+        # Only the worker holds its end now, so the pipe reports EOF when it dies.
+        child_conn.close()
+        self.procs[index], self.conns[index] = proc, parent_conn
+        for task in self.assigned[index]:
+            self._send(index, task)
+
+    def _send(self, index, task):
+        try:
+            self.conns[index].send(task)
+        except OSError:
+            # The worker died; results() fails or reassigns its tasks.
+            pass
+
+    def __len__(self):
+        """Tasks submitted and not yet returned."""
+        return sum(map(len, self.assigned))
+
+    def free(self):
+        return any(len(tasks) < self.depth for tasks in self.assigned)
+
+    def submit(self, task):
+        index = min(range(len(self.assigned)), key=lambda i: len(self.assigned[i]))
+        self.assigned[index].append(task)
+        if self.procs[index] is None:
+            self._spawn(index)
+        else:
+            self._send(index, task)
+
+    def results(self, timeout=0):
+        """(task, result) pairs, waiting up to `timeout` seconds for the first.
+
+        The task a dead worker was running comes back as failed.
+        """
+        live = [index for index, proc in enumerate(self.procs) if proc is not None]
+        wait([self.conns[i] for i in live] + [self.procs[i].sentinel for i in live], timeout)
+        # Check for dead workers before reading, so results they sent just
+        # before dying are still picked up.
+        dead = [index for index in live if not self.procs[index].is_alive()]
+        done = []
+        for index in live:
+            conn = self.conns[index]
+            try:
+                while conn.poll():
+                    result = conn.recv()
+                    done.append((self.assigned[index].popleft(), result))
+            except (EOFError, OSError):
+                pass
+
+        for index in dead:
+            proc = self.procs[index]
+            proc.join()
+            self.conns[index].close()
+            self.procs[index] = self.conns[index] = None
+            tasks = self.assigned[index]
+            if tasks:
+                task = tasks.popleft()
+                done.append((task, (task[0], f"worker exited with code {proc.exitcode}", 0.0, {}, None)))
+            if tasks:
+                self._spawn(index)
+        return done
+
+    def close(self):
+        """Stop the workers once they have finished the tasks they hold."""
+        for index, proc in enumerate(self.procs):
+            if proc is not None:
+                self._send(index, None)
+        for proc in self.procs:
+            if proc is not None:
+                proc.join()
+
+    def terminate(self):
+        for proc in self.procs:
+            if proc is not None:
+                proc.terminate()
+                proc.join()
+        self.procs = [None] * len(self.procs)
+
+
+def _flush_cache(models):
+    cache = models.get('embedding_cache')
+    if cache is not None:
+        cache.flush()
+    return cache
+
+
+def collect_tasks(input_dir, output_dir):
+    tasks = []
+    for filename in sorted(os.listdir(input_dir)):
+        if filename.lower().endswith('.pdf'):
+            tasks.append((os.path.join(input_dir, filename), output_file(output_dir, filename)))
+    return tasks
+
+
+def output_file(output_dir, filename):
+    return os.path.join(output_dir, filename.replace('.pdf', '.json'))
+
+
+def page_cache_options(output_dir, model_version, settings):
+    """Options that enable the per-page cache under `output_dir`/.cache."""
+    return {
+        'cache_dir': os.path.join(output_dir, '.cache'),
+        'cache_version': hashlib.sha1(json.dumps([model_version, settings], sort_keys=True).encode()).hexdigest()
+    }
+
+
+def run_batch(tasks, model_dir, workers=None, batch_pages=None, queue_size=None, profile=None, ndjson=None,
+              incremental=True, force=False, shards=1, threads=None):
+    """Process (pdf_path, output_path) tasks serially or on a pool of worker processes.
+
+    With the fork start method the models are loaded once in the parent and shared
+    copy-on-write; otherwise every worker loads them once at startup. Each worker holds
+    at most `queue_size` / `workers` tasks (default 2), so huge directories are not
+    buffered up front, and a worker that dies fails only the file it was processing.
+
+    With `profile` (or $EXTRACT_PROFILE=1) each output gets a `.profile.json`
+    sidecar with per-stage timings and the run writes `profile_summary.json`.
+
+    `ndjson` streams outline records while each document is processed, to a
+    `.ndjson` file next to each output or to stdout for '-'; the JSON outputs
+    are still written at the end of each document. Files skipped as unchanged
+    have their records replayed from the existing output.
+
+    With `incremental`, manifest.json in the output directory records each input's
+    content hash, model version and settings; unchanged inputs are skipped unless
+    `force` is set, and changed ones reuse cached results for unchanged pages.
+
+    With `shards` > 1 (serial runs only) each document's pages are parsed in up
+    to `shards` page ranges on a process pool, so one huge PDF uses several cores.
+
+    `workers` and `threads` (torch/BLAS threads per worker) default to the
+    thread budget: $WORKERS / $THREADS, the split saved by
+    `benchmark.py --tune-threads`, or the cores divided between the workers.
+    """
+    if profile is None:
+        profile = profiling_enabled()
+    workers, threads = thread_budget(workers, threads)
+    options = {'batch_pages': batch_pages, 'profile': profile, 'ndjson': ndjson, 'shards': shards,
+               'threads': threads}
+    # Keep stdout clean for the NDJSON stream.
+    log = partial(print, file=sys.stderr if ndjson == '-' else sys.stdout)
+
+    manifest = None
+    skipped = 0
+    if incremental and tasks:
+        output_dir = os.path.dirname(tasks[0][1])
+        manifest = Manifest(output_dir)
+        model_version = model_fingerprint(model_dir)
+        settings = extractor_settings()
+        options.update(page_cache_options(output_dir, model_version, settings))
+
+        hashes = {}
+        todo = []
+        for pdf_path, output_path in tasks:
+            hashes[pdf_path] = file_sha256(pdf_path)
+            name = os.path.basename(pdf_path)
+            if not force and manifest.is_current(name, hashes[pdf_path], model_version, settings, output_path):
+                skipped += 1
+                if ndjson:
+                    _replay(pdf_path, output_path, ndjson)
+            else:
+                todo.append((pdf_path, output_path))
+        tasks = todo
+    start = time.perf_counter()
+    results = []
+
+    if not tasks:
+        pass
+    elif workers <= 1:
+        models = load_models(model_dir, threads=threads)
+        # Shard workers only parse pages and never touch the models.
+        pool = mp.get_context().Pool(shards) if shards > 1 else None
+        try:
+            for task in tasks:
+                results.append(_process_one(*task, models, options, pool))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        cache = _flush_cache(models)
+        if cache is not None:
+            log(f"Embedding cache: {cache.stats()}")
+    else:
+        pool = WorkerPool(workers, model_dir, options, depth=max(1, (queue_size or workers * 2) // workers))
+        pending = deque(tasks)
+        try:
+            while len(results) < len(tasks):
+                while pending and pool.free():
+                    pool.submit(pending.popleft())
+                results.extend(result for _, result in pool.results(timeout=1.0))
+        finally:
+            pool.close()
+
+    if manifest is not None:
+        outputs = dict(tasks)
+        for path, error, _, stats, _ in results:
+            if not error:
+                manifest.record(os.path.basename(path), hashes[path], model_version, settings, outputs[path],
+                                source=outline_source(stats))
+        manifest.save()
+
+    elapsed = time.perf_counter() - start
+    failed = [(path, error) for path, error, _, _, _ in results if error]
+    totals = Counter()
+    for _, _, _, stats, _ in results:
+        totals.update(stats)
+    total_bytes = sum(os.path.getsize(path) for path, _ in tasks)
+    summary = {
+        "files": len(tasks),
+        "skipped": skipped,
+        "failed": len(failed),
+        "workers": workers,
+        "threads": threads,
+        "seconds": round(elapsed, 3),
+        "pages": totals['pages'],
+        "files_per_sec": round(len(tasks) / elapsed, 3) if elapsed else 0.0,
+        "pages_per_sec": round(totals['pages'] / elapsed, 3) if elapsed else 0.0,
+        "mb_per_sec": round(total_bytes / 1e6 / elapsed, 3) if elapsed else 0.0,
+        "candidates": totals['candidates'],
+        "embedded": totals['embedded'],
+        "settled": totals['settled'],
+        "classify_failed": totals['classify_failed'],
+        "bookmark_outlines": totals['bookmark_outlines']
+    }
+    for path, error in failed:
+        log(f"Failed {path}: {error}")
+    if skipped:
+        log(f"Skipped {skipped} unchanged files")
+    log(f"Processed {summary['files']} files ({summary['pages']} pages) with {workers} worker(s) "
+          f"x {threads} thread(s) in {summary['seconds']}s ({summary['files_per_sec']} files/s, "
+          f"{summary['pages_per_sec']} pages/s, {summary['mb_per_sec']} MB/s)")
+    if totals['bookmark_outlines']:
+        log(f"{totals['bookmark_outlines']} file(s) used their embedded bookmark outline")
+    if totals['cascaded']:
+        log(f"Structural cascade settled {totals['settled'] / totals['cascaded']:.1%} of {totals['cascaded']} "
+            f"candidate blocks without the embedding model")
+    if totals['classify_failed']:
+        log(f"{totals['classify_failed']} candidate blocks could not be classified and were treated as non-headings")
+    if profile and tasks:
+        run_profile = summarize({path: report for path, _, _, _, report in results if report})
+        run_profile["run"] = summary
+        summary_path = os.path.join(os.path.dirname(tasks[0][1]), 'profile_summary.json')
+        write_json_atomic(summary_path, run_profile)
+        log(f"Profile summary written to {summary_path}")
+    return summary
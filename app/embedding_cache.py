@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import hashlib
+import fcntl
+import atexit
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    # MiniLM's tokenizer splits on whitespace, so collapsing it does not change the embedding.
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def key_hash(key):
+    """Nonzero 64-bit hash of a cache key, stored next to its row (0 marks a row being written)."""
+    digest = hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class DiskEmbeddingStore:
+    """Ring buffer of embeddings in a memory-mapped float32 file plus an append-only key log.
+
+    New rows are buffered and written under a file lock on flush(), so several
+    worker processes can share one store; each flush appends one `[row, key]`
+    line per new row to the log, which is compacted once it holds twice
+    `capacity` lines. Once `capacity` rows are used the oldest row is
+    overwritten. A hash of every row's key is kept next to the row and checked
+    around the copy on read, so a process whose view of the log is stale gets a
+    miss rather than another text's embedding. The store is wiped when the
+    model fingerprint changes.
+    """
+
+    def __init__(self, cache_dir, fingerprint, capacity=100000):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.capacity = capacity
+        self.meta_path = os.path.join(cache_dir, 'meta.json')
+        self.log_path = os.path.join(cache_dir, 'keys.log')
+        self.data_path = os.path.join(cache_dir, 'embeddings.f32')
+        self.hash_path = os.path.join(cache_dir, 'keys.u64')
+        self.lock_path = os.path.join(cache_dir, 'lock')
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.dim = None
+        self.pending = OrderedDict()
+        self._reset_view()
+        with self._locked():
+            self._open()
+
+    def _locked(self):
+        return _FileLock(self.lock_path)
+
+    def _reset_view(self):
+        self.rows = {}
+        self.slots = {}
+        self.next = 0
+        self.lines = 0
+        self._log_id = None
+        self._log_offset = 0
+        self._data = None
+        self._hashes = None
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('fingerprint') != self.fingerprint or meta.get('capacity') != self.capacity:
+            return None
+        return meta
+
+    def _write_meta(self, meta):
+        tmp_path = f"{self.meta_path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _open(self):
+        # Called with the lock held: validate (or wipe) the store and read the whole log.
+        meta = self._read_meta()
+        if meta is None:
+            for path in (self.log_path, self.data_path, self.hash_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            meta = {'fingerprint': self.fingerprint, 'capacity': self.capacity, 'dim': None}
+            self._write_meta(meta)
+        self._reset_view()
+        self.dim = meta['dim']
+        with open(self.log_path, 'ab+') as f:
+            f.seek(0)
+            self._log_id = os.fstat(f.fileno()).st_ino
+            self._read_log(f)
+
+    def _read_log(self, f):
+        chunk = f.read()
+        # A line still being appended is picked up on the next read.
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].splitlines():
+            row, key = json.loads(line)
+            self._assign(row, key)
+            self.lines += 1
+        self._log_offset += end
+        if self.dim is None and self.rows:
+            meta = self._read_meta()
+            self.dim = meta['dim'] if meta is not None else None
+
+    def _assign(self, row, key):
+        old = self.slots.get(row)
+        if old is not None and self.rows.get(old) == row:
+            del self.rows[old]
+        self.slots[row] = key
+        self.rows[key] = row
+        self.next = (row + 1) % self.capacity
+
+    def _sync(self):
+        """Read log lines appended since the last look; False if the log was replaced."""
+        try:
+            f = open(self.log_path, 'rb')
+        except OSError:
+            return False
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._log_id or stat.st_size < self._log_offset:
+                return False
+            if stat.st_size > self._log_offset:
+                f.seek(self._log_offset)
+                self._read_log(f)
+        return True
+
+    def _arrays(self, mode='r'):
+        if self._data is None or (mode == 'r+' and self._data.mode != 'r+'):
+            for path, dtype, shape in ((self.data_path, np.float32, (self.capacity, self.dim)),
+                                       (self.hash_path, np.uint64, (self.capacity,))):
+                if not os.path.exists(path):
+                    np.memmap(path, dtype=dtype, mode='w+', shape=shape).flush()
+            self._data = np.memmap(self.data_path, dtype=np.float32, mode=mode,
+                                   shape=(self.capacity, self.dim))
+            self._hashes = np.memmap(self.hash_path, dtype=np.uint64, mode=mode,
+                                     shape=(self.capacity,))
+        return self._data, self._hashes
+
+    def refresh(self):
+        """Pick up rows written by other processes since the last look."""
+        if not self._sync():
+            # Compacted or wiped by another process: read it afresh.
+            with self._locked():
+                self._open()
+
+    def get(self, key):
+        if key in self.pending:
+            return self.pending[key]
+        row = self.rows.get(key)
+        if row is None or self.dim is None:
+            return None
+        data, hashes = self._arrays()
+        expected = key_hash(key)
+        if hashes[row] != expected:
+            return None
+        vector = np.array(data[row])
+        # Checked again after the copy: a writer zeroes the hash before it
+        # overwrites the row.
+        if hashes[row] != expected:
+            return None
+        return vector
+
+    def put(self, key, vector):
+        if key not in self.rows:
+            self.pending[key] = vector
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self._locked():
+            if not self._sync():
+                self._open()
+            if self.dim is None:
+                self.dim = len(next(iter(self.pending.values())))
+                self._write_meta({'fingerprint': self.fingerprint, 'capacity': self.capacity,
+                                  'dim': self.dim})
+            data, hashes = self._arrays('r+')
+            lines = []
+            for key, vector in self.pending.items():
+                if key in self.rows:
+                    continue
+                row = self.next
+                hashes[row] = 0
+                data[row] = vector
+                hashes[row] = key_hash(key)
+                self._assign(row, key)
+                lines.append(json.dumps([row, key]) + '\n')
+            data.flush()
+            hashes.flush()
+            if lines:
+                with open(self.log_path, 'ab') as f:
+                    f.write(''.join(lines).encode('ascii'))
+                    self._log_offset = f.tell()
+                self.lines += len(lines)
+                if self.lines > 2 * self.capacity:
+                    self._compact()
+        self.pending.clear()
+
+    def _compact(self):
+        # Called with the lock held: rewrite the log with one line per live row,
+        # oldest first, so replaying it restores `next`.
+        tmp_path = f"{self.log_path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            for row in sorted(self.slots, key=lambda row: (row - self.next) % self.capacity):
+                f.write(json.dumps([row, self.slots[row]]) + '\n')
+        os.replace(tmp_path, self.log_path)
+        self._open()
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+class EmbeddingCache:
+    """LRU of block embeddings keyed by normalized text, optionally backed by disk.
+
+    Safe to share between threads; the lock is not held while `encode_fn` runs,
+    so concurrent callers can have their misses encoded together.
+    """
+
+    def __init__(self, fingerprint, max_entries=10000, cache_dir=None, disk_capacity=100000,
+                 flush_every=256):
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.memory = OrderedDict()
+        self.disk = DiskEmbeddingStore(cache_dir, fingerprint, disk_capacity) if cache_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.disk is not None:
+            atexit.register(self.flush)
+
+    def _lookup(self, key):
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+        return vector
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def encode(self, texts, encode_fn):
+        """Embeddings for `texts`; only texts missing from the cache go to `encode_fn`."""
+        keys = [normalize_text(t) for t in texts]
+        vectors = [None] * len(keys)
+        missing = OrderedDict()
+        with self.lock:
+            if self.disk is not None:
+                self.disk.refresh()
+            for i, key in enumerate(keys):
+                vector = self._lookup(key)
+                if vector is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    vectors[i] = vector
+            self.hits += len(keys) - sum(len(positions) for positions in missing.values())
+            self.misses += sum(len(positions) for positions in missing.values())
+
+        if missing:
+            encoded = encode_fn(list(missing))
+            with self.lock:
+                for (key, positions), vector in zip(missing.items(), encoded):
+                    vector = np.asarray(vector, dtype=np.float32)
+                    self._remember(key, vector)
+                    if self.disk is not None:
+                        self.disk.put(key, vector)
+                    for i in positions:
+                        vectors[i] = vector
+                if self.disk is not None and len(self.disk.pending) >= self.flush_every:
+                    self.disk.flush()
+
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(vectors)
+
+    def flush(self):
+        if self.disk is not None:
+            with self.lock:
+                self.disk.flush()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk.rows) if self.disk is not None else 0
+        }
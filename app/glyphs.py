@@ -0,0 +1,94 @@
+import os
+from pdfminer.converter import PDFLayoutAnalyzer
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdfinterp import PDFPageInterpreter
+from pdfminer.utils import apply_matrix_pt
+
+# Text-only extraction backend. pdfplumber builds a layout object for every
+# char, rect, line, curve and image on a page and then converts each one into a
+# dict with all of its attributes; we only ever read six fields of the chars.
+# GlyphDevice runs pdfminer's interpreter on the page but drops paths and
+# images, and records each glyph with the same geometry LTChar would compute.
+#
+# Select it with $PDF_BACKEND=glyphs (default: pdfplumber).
+
+BACKENDS = ('pdfplumber', 'glyphs')
+
+
+def pdf_backend():
+    return os.getenv('PDF_BACKEND', 'pdfplumber')
+
+
+class GlyphDevice(PDFLayoutAnalyzer):
+    """Collects {text, size, x0, x1, top, bottom} for every glyph of a page."""
+
+    def __init__(self, rsrcmgr, page_height, pageno=1):
+        super().__init__(rsrcmgr, pageno=pageno, laparams=None)
+        self.page_height = page_height
+        self.glyphs = []
+
+    def paint_path(self, gstate, stroke, fill, evenodd, path):
+        pass
+
+    def render_image(self, name, stream):
+        pass
+
+    def render_char(self, matrix, font, fontsize, scaling, rise, cid, ncs, graphicstate):
+        try:
+            text = font.to_unichr(cid)
+        except PDFUnicodeNotDefined:
+            text = self.handle_undefined_char(font, cid)
+        adv = font.char_width(cid) * fontsize * scaling
+
+        # Same bounding box as pdfminer's LTChar.
+        vertical = font.is_vertical()
+        if vertical:
+            vx, vy = font.char_disp(cid)
+            vx = fontsize * 0.5 if vx is None else vx * fontsize * 0.001
+            vy = (1000 - vy) * fontsize * 0.001
+            lower_left = (-vx, vy + rise + adv)
+            upper_right = (-vx + fontsize, vy + rise)
+        else:
+            descent = font.get_descent() * fontsize
+            lower_left = (0, descent + rise)
+            upper_right = (adv, descent + rise + fontsize)
+        x0, y0 = apply_matrix_pt(matrix, lower_left)
+        x1, y1 = apply_matrix_pt(matrix, upper_right)
+        if x1 < x0:
+            x0, x1 = x1, x0
+        if y1 < y0:
+            y0, y1 = y1, y0
+
+        self.glyphs.append({
+            "text": text,
+            "size": x1 - x0 if vertical else y1 - y0,
+            "x0": x0,
+            "x1": x1,
+            "top": self.page_height - y1,
+            "bottom": self.page_height - y0
+        })
+        return adv
+
+
+def page_glyphs(page):
+    """Glyph records of a pdfplumber page, parsed once and kept on the page."""
+    glyphs = getattr(page, '_glyphs', None)
+    if glyphs is None:
+        rsrcmgr = page.pdf.rsrcmgr
+        device = GlyphDevice(rsrcmgr, page.height, page.page_number)
+        PDFPageInterpreter(rsrcmgr, device).process_page(page.page_obj)
+        glyphs = page._glyphs = device.glyphs
+    return glyphs
+
+
+def page_chars(page):
+    """The chars of `page` from the backend selected by $PDF_BACKEND."""
+    if pdf_backend() == 'glyphs':
+        return page_glyphs(page)
+    return getattr(page, 'chars', None)
+
+
+def release_page(page):
+    """Drop everything parsed for `page`; it is re-parsed if read again."""
+    page.flush_cache()
+    page.__dict__.pop('_glyphs', None)
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import pdfplumber
+from pdfminer.pdftypes import PDFObjRef, PDFStream, resolve1
+from pdfminer.psparser import LIT
+from collections import Counter
+from utils import body_font_size, is_above_body_size, static_enabled, write_json_atomic
+from main import (bookmark_result, group_page, page_title, page_candidates, classify_candidates,
+                  iter_page_windows)
+from instrument import NULL_PROFILER
+from memory import page_done
+from bookmarks import bookmarks_enabled
+
+# Incremental re-processing of an input directory. manifest.json in the output
+# directory records, per input file, its content hash, the model version and the
+# extractor settings; unchanged files are skipped. Per-document page caches,
+# keyed by each page's content fingerprint, keep the parsed candidates and the
+# classified outline of every page so an edited or appended PDF only re-parses
+# the pages that changed.
+
+# Bump when a change to the extraction logic should invalidate earlier outputs.
+EXTRACTOR_VERSION = 2
+
+LITERAL_IMAGE = LIT('Image')
+
+
+def extractor_settings():
+    return {
+        "extractor_version": EXTRACTOR_VERSION,
+        "line_tolerance": 3,
+        "merge_gap_threshold": 10,
+        "int8": os.getenv('MINILM_INT8', '0') == '1',
+        "embedding": 'static' if static_enabled() else 'minilm',
+        "bookmarks": bookmarks_enabled()
+    }
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, 'manifest.json')
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f).get('files', {})
+        except (OSError, ValueError):
+            self.files = {}
+
+    def is_current(self, name, sha256, model_version, settings, output_path):
+        entry = self.files.get(name)
+        return (
+            entry is not None
+            and entry['sha256'] == sha256
+            and entry['model_version'] == model_version
+            and entry['settings'] == settings
+            and os.path.exists(output_path)
+        )
+
+    def record(self, name, sha256, model_version, settings, output_path, **extra):
+        self.files[name] = dict(extra, sha256=sha256, model_version=model_version,
+                                settings=settings, output=os.path.basename(output_path))
+
+    def save(self):
+        write_json_atomic(self.path, {"files": self.files})
+
+
+def _hash_object(digest, obj, seen):
+    """Feed `obj` and everything it references into `digest`, each indirect object once.
+
+    Streams contribute their dictionary and decoded data, except image data,
+    which cannot change the chars.
+    """
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in seen:
+            digest.update(f"@{seen[obj.objid]}".encode())
+            return
+        seen[obj.objid] = len(seen)
+        obj = resolve1(obj)
+    if isinstance(obj, PDFStream):
+        _hash_object(digest, obj.attrs, seen)
+        if resolve1(obj.attrs.get('Subtype')) is not LITERAL_IMAGE:
+            digest.update(obj.get_data())
+    elif isinstance(obj, dict):
+        digest.update(b"<<")
+        for key in sorted(obj):
+            digest.update(key.encode())
+            _hash_object(digest, obj[key], seen)
+        digest.update(b">>")
+    elif isinstance(obj, list):
+        digest.update(b"[")
+        for item in obj:
+            _hash_object(digest, item, seen)
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode())
+
+
+def page_fingerprint(page, page_num):
+    """Hash of what determines a page's chars: geometry, content streams and resources.
+
+    Resources are hashed in full, so text drawn from Form XObjects and font
+    changes (encodings, ToUnicode maps, embedded font files) are covered.
+    """
+    digest = hashlib.sha1()
+    obj = page.page_obj
+    digest.update(repr((page_num == 1, obj.mediabox, obj.cropbox, obj.rotate)).encode())
+    for stream in obj.contents:
+        digest.update(resolve1(stream).get_data())
+    _hash_object(digest, obj.resources or {}, {})
+    return digest.hexdigest()
+
+
+def _parse_page(page, page_num, title_texts, stats, profiler):
+    font_counter = Counter()
+    blocks = group_page(page, page_num, font_counter, profiler)
+    title = page_title(page, blocks, profiler).strip() if page_num == 1 else None
+    if page_num == 1:
+        title_texts = title
+    candidates = page_candidates(page, page_num, blocks, title_texts, stats, profiler) if blocks else []
+    for candidate in candidates:
+        del candidate['page']
+    return {
+        "sizes": list(font_counter.items()),
+        "title": title,
+        "candidates": candidates
+    }
+
+
+def process_pdf_incremental(pdf_path, models, cache_path, cache_version, stats=None,
+                            profiler=NULL_PROFILER, pool=None, shards=1, batch_pages=None):
+    """process_pdf with a per-page cache stored at `cache_path`.
+
+    Pages whose fingerprint is cached reuse their candidates without parsing;
+    their outline entries are reused as long as the document's body font size
+    is unchanged. The cache is dropped when `cache_version` (model version and
+    settings) differs from the one it was written with. With a `pool`, the
+    uncached pages are parsed in `shards` page ranges on it. Pages to classify
+    are batched every `batch_pages` pages, as in process_pdf. Documents with a
+    usable bookmark outline bypass the cache.
+    """
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cached_pages = cache.get('pages', {}) if cache.get('version') == cache_version else {}
+
+    pages = []
+    with profiler.stage('open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        result = bookmark_result(pdf, stats, profiler)
+        if result is not None:
+            return result
+        for page_num, page in enumerate(pdf.pages, 1):
+            with profiler.stage('fingerprint', page_num):
+                key = page_fingerprint(page, page_num)
+            entry = cached_pages.get(key)
+            # Identical pages share a cache entry; give each its own copy.
+            pages.append((key, dict(entry) if entry is not None else None))
+
+        missing = [page_num for page_num, (_, entry) in enumerate(pages, 1) if entry is None]
+        if pool is not None and shards > 1 and len(missing) > 1:
+            from sharding import parse_pages
+            parsed = parse_pages(pdf_path, missing, pool, shards, stats, profiler)
+        else:
+            parsed = []
+            for page_num in missing:
+                page = pdf.pages[page_num - 1]
+                parsed.append(_parse_page(page, page_num, "", stats, profiler))
+                page_done(page, page_num)
+                if stats is not None:
+                    stats['pages_parsed'] += 1
+        for page_num, entry in zip(missing, parsed):
+            pages[page_num - 1] = (pages[page_num - 1][0], entry)
+        if stats is not None:
+            stats['pages'] += len(pdf.pages)
+
+    title = pages[0][1]['title'] if pages else ""
+    font_counter = Counter()
+    for key, entry in pages:
+        font_counter.update(dict((size, count) for size, count in entry['sizes']))
+
+    body_size = body_font_size(font_counter)
+
+    # Classify every page without an outline for this body size, in one batch
+    # or every `batch_pages` pages.
+    to_classify = []
+    for page_num, (key, entry) in enumerate(pages, 1):
+        if entry.get('body_size') != body_size:
+            entry['outline'] = []
+            entry['body_size'] = body_size
+            to_classify.extend(
+                dict(c, page=page_num) for c in entry['candidates']
+                if is_above_body_size(c['block'], body_size)
+            )
+    for window in iter_page_windows(to_classify, batch_pages):
+        for item in classify_candidates(window, body_size, models, stats, profiler):
+            pages[item['page'] - 1][1]['outline'].append(item)
+
+    outline = []
+    for page_num, (key, entry) in enumerate(pages, 1):
+        outline.extend(dict(item, page=page_num) for item in entry['outline'])
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    write_json_atomic(cache_path, {"version": cache_version, "pages": {key: entry for key, entry in pages}})
+    return {"title": title, "outline": outline, "source": "model"}
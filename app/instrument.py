@@ -0,0 +1,119 @@
+import os
+import time
+from collections import Counter, defaultdict
+
+# Opt-in per-stage timing for process_pdf. Code under measurement always calls
+# profiler.stage(...); with the NullProfiler that is a method call returning a
+# shared no-op context manager, so the disabled path costs next to nothing.
+
+
+def profiling_enabled():
+    return os.getenv('EXTRACT_PROFILE', '0') == '1'
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullProfiler:
+    enabled = False
+
+    def stage(self, name, page=None):
+        return _NULL_STAGE
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'page', 'start')
+
+    def __init__(self, profiler, name, page):
+        self.profiler = profiler
+        self.name = name
+        self.page = page
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.page)
+        return False
+
+
+class Profiler:
+    """Wall time per stage, per page and for the whole document."""
+
+    enabled = True
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.calls = Counter()
+        self.pages = defaultdict(lambda: defaultdict(float))
+
+    def stage(self, name, page=None):
+        return _Stage(self, name, page)
+
+    def record(self, name, seconds, page=None):
+        self.stages[name] += seconds
+        self.calls[name] += 1
+        if page is not None:
+            self.pages[page][name] += seconds
+
+    def merge(self, report):
+        """Fold in a report produced elsewhere, e.g. by a shard worker process."""
+        for name, stage in report["stages"].items():
+            self.stages[name] += stage["seconds"]
+            self.calls[name] += stage["calls"]
+        for entry in report["pages"]:
+            for name, seconds in entry["stages"].items():
+                self.pages[entry["page"]][name] += seconds
+
+    def report(self, counters=None):
+        return {
+            "total_seconds": round(time.perf_counter() - self.start, 6),
+            "stages": {
+                name: {"seconds": round(seconds, 6), "calls": self.calls[name]}
+                for name, seconds in self.stages.items()
+            },
+            "pages": [
+                {"page": page, "stages": {name: round(s, 6) for name, s in stages.items()}}
+                for page, stages in sorted(self.pages.items())
+            ],
+            "counters": dict(counters or {})
+        }
+
+
+def summarize(reports):
+    """Aggregate per-document reports into a run summary."""
+    stages = defaultdict(lambda: {"seconds": 0.0, "calls": 0})
+    counters = Counter()
+    documents = {}
+    for path, report in reports.items():
+        documents[path] = report["total_seconds"]
+        counters.update(report["counters"])
+        for name, stage in report["stages"].items():
+            stages[name]["seconds"] += stage["seconds"]
+            stages[name]["calls"] += stage["calls"]
+
+    total = sum(documents.values())
+    return {
+        "documents": len(documents),
+        "total_seconds": round(total, 6),
+        "stages": {
+            name: dict(stage, seconds=round(stage["seconds"], 6),
+                       share=round(stage["seconds"] / total, 4) if total else 0.0)
+            for name, stage in sorted(stages.items(), key=lambda item: -item[1]["seconds"])
+        },
+        "counters": dict(counters),
+        "document_seconds": documents
+    }
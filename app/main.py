@@ -1,111 +1,355 @@
 import os
-import json
 import re
+import json
+import numpy as np
 import pdfplumber
+from collections import Counter
+from itertools import groupby
 from pathlib import Path
 from utils import (
-    load_models,
+    body_font_size,
     compute_body_font_size,
     extract_title_blocks,
-    group_text_blocks,
-    extract_features,
-    is_valid_heading,
-    determine_heading_level,
-    is_header_footer,
-    merge_blocks_if_continuous
+    group_text_table,
+    structural_matrix,
+    structural_cascade,
+    project_features,
+    is_valid_heading_text,
+    is_above_body_size,
+    determine_heading_level
 )
-import shutil
+from instrument import NULL_PROFILER
+from glyphs import page_chars
+from memory import iter_pages, low_memory_enabled
+from bookmarks import bookmarks_enabled, read_bookmarks
+
+NUMBERED_RE = re.compile(r"\d+\.")
+
+def classify_candidates(candidates, body_size, models, stats=None, profiler=NULL_PROFILER):
+    """Classify a batch of candidate blocks and return their outline entries in order.
+
+    The structural cascade settles confident blocks first; only the uncertain
+    ones are embedded and sent through PCA and classifier_head. If that path
+    fails, the uncertain blocks count as stats['classify_failed'] and are
+    treated as non-headings.
+    """
+    if not candidates:
+        return []
+
+    n = len(candidates)
+    classifier_calls = 0
+    cascaded = 0
+    is_heading = np.zeros(n, dtype=bool)
+    uncertain = np.arange(n)
+    try:
+        with profiler.stage('structural'):
+            structural = structural_matrix(candidates, body_size)
+        with profiler.stage('cascade'):
+            decided, is_heading = structural_cascade(structural, models)
+        if models.get('classifier_struct') is not None:
+            cascaded = n
+        uncertain = np.flatnonzero(~decided)
+        if len(uncertain):
+            texts = [candidates[i]['block']['text'] for i in uncertain]
+            features = project_features(structural[uncertain], texts, models, profiler)
+            with profiler.stage('classifier'):
+                is_heading[uncertain] = models['classifier_head'].predict(features).astype(bool)
+            classifier_calls += 1
+        failed = 0
+    except Exception:
+        # Decisions the cascade already made stand; only the rows still
+        # uncertain fall back to non-headings.
+        is_heading[uncertain] = False
+        failed = len(uncertain)
+
+    if stats is not None:
+        stats['candidates'] += n
+        stats['cascaded'] += cascaded
+        stats['settled'] += n - len(uncertain)
+        stats['embedded'] += len(uncertain) - failed
+        stats['classify_failed'] += failed
+        stats['classifier_calls'] += classifier_calls
 
-def process_pdf(pdf_path, models):
-    title = ""
     outline = []
+    with profiler.stage('levels'):
+        for candidate, heading in zip(candidates, is_heading):
+            block = candidate['block']
+            if heading or NUMBERED_RE.match(block['text']):
+                level = determine_heading_level(block, body_size)
+                outline.append({
+                    "level": level,
+                    "text": block['text'].strip(),
+                    "page": candidate['page']
+                })
+    return outline
 
-    with pdfplumber.open(pdf_path) as pdf:
-        body_size = compute_body_font_size(pdf)
 
-        title_blocks = []
-        if pdf.pages:
-            title_blocks = extract_title_blocks(pdf.pages[0])
-            title = title_blocks['text']
+def iter_page_windows(candidates, batch_pages):
+    if not batch_pages:
+        if candidates:
+            yield candidates
+        return
+    for _, window in groupby(candidates, key=lambda c: (c['page'] - 1) // batch_pages):
+        yield list(window)
 
-        title_texts = title.strip()
 
-        for page_num, page in enumerate(pdf.pages, 1):
-            blocks = group_text_blocks(page)
-            if not blocks:
+def group_page(page, page_num, font_counter=None, profiler=NULL_PROFILER):
+    with profiler.stage('parse', page_num):
+        page_chars(page)
+    with profiler.stage('group', page_num):
+        return group_text_table(page, font_counter=font_counter)
+
+
+def page_candidates(page, page_num, blocks, title_texts, stats=None, profiler=NULL_PROFILER):
+    """Merge a page's lines and keep the blocks that pass the text-only heading checks.
+
+    `blocks` is the page's BlockTable; sorting, merging and the header/footer
+    test run over its columns, and only the merged blocks become dicts.
+    """
+    with profiler.stage('merge', page_num):
+        # Sort by reading order
+        table = blocks.reading_order().merge_continuous()
+    if stats is not None:
+        stats['blocks'] += len(table)
+
+    candidates = []
+    with profiler.stage('filter', page_num):
+        blocks = table.to_blocks()
+        body = np.flatnonzero(~table.header_footer_mask(page.height))
+        for i in body.tolist():
+            block = blocks[i]
+            if not is_valid_heading_text(block):
                 continue
 
-            # Sort by reading order
-            blocks.sort(key=lambda b: (b['top'], b['x0']))
-            blocks = merge_blocks_if_continuous(blocks, page.height, False)
-            # for block in blocks:
-            #     print(block['text'])
-
-            for i, block in enumerate(blocks):
-                if is_header_footer(block, page.height):
-                    continue
-
-                if not is_valid_heading(block, page_num, body_size):
-                    continue
-
-                if page_num == 1 and block['text'].strip() in title_texts:
-                    continue
-                
-                prev_block = blocks[i - 1] if i > 0 else None
-                next_block = blocks[i + 1] if i < len(blocks) - 1 else None
-
-                try:
-                    features = extract_features(
-                        block,
-                        prev_block,
-                        next_block,
-                        body_size,
-                        page.width,
-                        page.height,
-                        models
-                    )
-
-                    if models['classifier_head'].predict([features])[0]:
-                        level = determine_heading_level(block, body_size)
-                        outline.append({
-                            "level": level,
-                            "text": block['text'].strip(),
-                            "page": page_num
-                        })
-                    else:
-                        if re.match(r"^\d+\.", block['text']):
-                            level = determine_heading_level(block, body_size)
-                            outline.append({
-                                "level": level,
-                                "text": block['text'].strip(),
-                                "page": page_num
-                            })
-
-                except Exception:
-                    if re.match(r"^\d+\.", block['text']):
-                        level = determine_heading_level(block, body_size)
-                        outline.append({
-                            "level": level,
-                            "text": block['text'].strip(),
-                            "page": page_num
-                        })
-
-    return {"title": title.strip(), "outline": outline}
+            if page_num == 1 and block['text'].strip() in title_texts:
+                continue
+
+            candidates.append({
+                "block": block,
+                "prev": blocks[i - 1] if i > 0 else None,
+                "next": blocks[i + 1] if i < len(blocks) - 1 else None,
+                "page": page_num,
+                "width": page.width,
+                "height": page.height
+            })
+    return candidates
+
+
+def page_title(page, blocks, profiler=NULL_PROFILER):
+    if not blocks:
+        return ""
+    with profiler.stage('title', 1):
+        return extract_title_blocks(page, blocks)['text']
+
+
+def collect_candidates(pdf, stats=None, profiler=NULL_PROFILER):
+    """Single pass over the pages of an open PDF.
+
+    Each page's chars feed both the font-size histogram and the line grouping.
+    Only the body-size checks wait for the histogram to be complete.
+    Returns (title, body_size, candidates) with candidates in reading order.
+    """
+    title = ""
+    title_texts = ""
+    font_counter = Counter()
+    pending = []
+    for page_num, page in iter_pages(pdf):
+        blocks = group_page(page, page_num, font_counter, profiler)
+        if not blocks:
+            continue
+
+        if page_num == 1:
+            title = page_title(page, blocks, profiler)
+            title_texts = title.strip()
+
+        pending.extend(page_candidates(page, page_num, blocks, title_texts, stats, profiler))
+
+    body_size = body_font_size(font_counter)
+    candidates = [c for c in pending if is_above_body_size(c['block'], body_size)]
+    if stats is not None:
+        stats['pages'] += len(pdf.pages)
+        stats['pending'] += len(pending)
+    return title.strip(), body_size, candidates
+
+
+def bookmark_result(pdf, stats=None, profiler=NULL_PROFILER):
+    """{"title", "outline", "source"} from the PDF's bookmarks, or None to run the classifier.
+
+    Only page 1 is parsed, for the title. Documents answered this way have
+    source "bookmarks" (classified ones "model") and are counted as
+    stats['bookmark_outlines'].
+    """
+    if not bookmarks_enabled():
+        return None
+    with profiler.stage('bookmarks'):
+        outline = read_bookmarks(pdf)
+    if outline is None:
+        return None
+
+    title = ""
+    if pdf.pages:
+        page = pdf.pages[0]
+        title = page_title(page, group_page(page, 1, None, profiler), profiler)
+    if stats is not None:
+        stats['pages'] += len(pdf.pages)
+        stats['bookmark_outlines'] += 1
+    return {"title": title, "outline": outline, "source": "bookmarks"}
+
+
+def iter_outline(pdf, models, stats=None, profiler=NULL_PROFILER):
+    """Yield the title record, then each page's outline entries as soon as the page is classified.
+
+    The title needs only page 1, so it is yielded before anything else is
+    parsed. Heading records need the body size, so they follow a histogram
+    pass over all pages. A bookmark outline is yielded as is. The title
+    record carries the outline's source.
+    """
+    result = bookmark_result(pdf, stats, profiler)
+    if result is not None:
+        yield {"type": "title", "text": result['title'].strip(), "source": result['source']}
+        for entry in result['outline']:
+            yield dict(entry, type="heading")
+        return
+
+    title_texts = ""
+    first_blocks = None
+    if pdf.pages:
+        first_blocks = group_page(pdf.pages[0], 1, None, profiler)
+        title_texts = page_title(pdf.pages[0], first_blocks, profiler).strip()
+    yield {"type": "title", "text": title_texts, "source": "model"}
+
+    body_size = compute_body_font_size(pdf, profiler)
+    for page_num, page in iter_pages(pdf):
+        # Page 1 was grouped for the title already.
+        blocks = first_blocks if page_num == 1 else group_page(page, page_num, None, profiler)
+        if not blocks:
+            continue
+
+        candidates = [
+            c for c in page_candidates(page, page_num, blocks, title_texts, stats, profiler)
+            if is_above_body_size(c['block'], body_size)
+        ]
+        for entry in classify_candidates(candidates, body_size, models, stats, profiler):
+            yield dict(entry, type="heading")
+
+    if stats is not None:
+        stats['pages'] += len(pdf.pages)
+
+
+def outline_entry(record):
+    return {"level": record['level'], "text": record['text'], "page": record['page']}
+
+
+def ndjson_writer(pdf_path, out):
+    """emit(record): write `record`, tagged with the file name, as one flushed NDJSON line."""
+    name = os.path.basename(pdf_path)
+
+    def emit(record):
+        out.write(json.dumps(dict(record, file=name), ensure_ascii=False) + "\n")
+        out.flush()
+    return emit
+
+
+def stream_pdf(pdf_path, models, out, stats=None, profiler=NULL_PROFILER):
+    """Write NDJSON outline records to `out` as they are produced; returns the full result."""
+    emit = ndjson_writer(pdf_path, out)
+    title = ""
+    source = "model"
+    outline = []
+
+    with profiler.stage('open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        for record in iter_outline(pdf, models, stats, profiler):
+            if record['type'] == "title":
+                title, source = record['text'], record['source']
+            else:
+                outline.append(outline_entry(record))
+            emit(record)
+    emit({"type": "end", "headings": len(outline), "source": source})
+
+    return {"title": title, "outline": outline, "source": source}
+
+
+def replay_ndjson(pdf_path, result, out):
+    """Write the NDJSON records of an already extracted `result` to `out`."""
+    emit = ndjson_writer(pdf_path, out)
+    emit({"type": "title", "text": result['title'], "source": result['source']})
+    for entry in result['outline']:
+        emit(dict(entry, type="heading"))
+    emit({"type": "end", "headings": len(result['outline']), "source": result['source']})
+
+
+def process_pdf(pdf_path, models, batch_pages=None, stats=None, profiler=NULL_PROFILER):
+    if low_memory_enabled():
+        return process_pdf_bounded(pdf_path, models, stats, profiler)
+
+    with profiler.stage('open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        result = bookmark_result(pdf, stats, profiler)
+        if result is not None:
+            return result
+        title, body_size, candidates = collect_candidates(pdf, stats, profiler)
+
+    # Candidates are classified together, either for the whole document
+    # or every `batch_pages` pages, so MiniLM/PCA/forest run once per batch.
+    outline = []
+    for window in iter_page_windows(candidates, batch_pages):
+        outline.extend(classify_candidates(window, body_size, models, stats, profiler))
+
+    return {"title": title, "outline": outline, "source": "model"}
+
+
+def process_pdf_bounded(pdf_path, models, stats=None, profiler=NULL_PROFILER):
+    """process_pdf whose memory does not grow with the page count.
+
+    Pages are classified one at a time from the two-pass iter_outline
+    generator and released afterwards, so besides the current page only the
+    outline is held. Pages are parsed twice; batch_pages does not apply.
+    """
+    title = ""
+    source = "model"
+    outline = []
+    with profiler.stage('open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        for record in iter_outline(pdf, models, stats, profiler):
+            if record['type'] == "title":
+                title, source = record['text'], record['source']
+            else:
+                outline.append(outline_entry(record))
+    return {"title": title, "outline": outline, "source": source}
 
 
 if __name__ == "__main__":
-    model_dir = Path(os.getenv('MODEL_DIR', 'app/models'))
-    models = load_models(model_dir)
+    import argparse
+    from driver import collect_tasks, run_batch
 
-    input_dir = 'app/input'
-    output_dir = 'app/output'
-    os.makedirs(output_dir, exist_ok=True)
+    parser = argparse.ArgumentParser(description="Extract PDF outlines from an input directory.")
+    parser.add_argument('--input-dir', default='app/input')
+    parser.add_argument('--output-dir', default='app/output')
+    parser.add_argument('--workers', type=int,
+                        help="number of worker processes (default: $WORKERS, the tuned split, or 1)")
+    parser.add_argument('--threads', type=int,
+                        help="torch/BLAS threads per worker (default: $THREADS, the tuned split, "
+                             "or the cores divided between the workers)")
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARDS', '1')),
+                        help="with one worker, parse each document's pages in N parallel page ranges")
+    parser.add_argument('--profile', action='store_true', default=None,
+                        help="write per-stage timing sidecars (default: $EXTRACT_PROFILE=1)")
+    parser.add_argument('--ndjson', nargs='?', const='file', metavar='-',
+                        help="stream outline records page by page to <name>.ndjson, or to stdout with '-'")
+    parser.add_argument('--force', action='store_true',
+                        help="reprocess every input even if the manifest says it is unchanged")
+    parser.add_argument('--no-incremental', dest='incremental', action='store_false',
+                        help="ignore the manifest and page caches in the output directory")
+    args = parser.parse_args()
 
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith('.pdf'):
-            pdf_path = os.path.join(input_dir, filename)
-            result = process_pdf(pdf_path, models)
+    model_dir = Path(os.getenv('MODEL_DIR', 'app/models'))
+    batch_pages = int(os.getenv('BATCH_PAGES', '0')) or None
+    os.makedirs(args.output_dir, exist_ok=True)
 
-            output_path = os.path.join(output_dir, filename.replace('.pdf', '.json'))
-            with open(output_path, 'w') as f:
-                json.dump(result, f, indent=2)
+    tasks = collect_tasks(args.input_dir, args.output_dir)
+    run_batch(tasks, model_dir, args.workers, batch_pages, profile=args.profile, ndjson=args.ndjson,
+              incremental=args.incremental, force=args.force, shards=args.shards, threads=args.threads)
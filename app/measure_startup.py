@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Cold-start timing of load_models in fresh interpreters, pickles vs NumPy bundle
+# (and the static-embedding mode when it has been trained).
+# "classifier" is the time until PCA and classifier_head are usable,
+# "embedder" additionally includes importing torch and loading MiniLM.
+
+_SNIPPET = """
+import sys, json, time
+start = time.perf_counter()
+from pathlib import Path
+from utils import load_models
+models = load_models(Path(sys.argv[1]))
+loaded = time.perf_counter()
+models['projection'], models['classifier_head']
+classifier = time.perf_counter()
+models['minilm']
+embedder = time.perf_counter()
+print(json.dumps({"load_models": loaded - start, "classifier": classifier - start,
+                  "embedder": embedder - start}))
+"""
+
+
+def measure(model_dir, bundle, runs, static=False):
+    env = dict(os.environ, MODEL_BUNDLE='1' if bundle else '0', EMBEDDING='static' if static else 'minilm',
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', _SNIPPET, str(model_dir)], env=env,
+                             check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {key: round(statistics.median(s[key] for s in samples), 4) for key in samples[0]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold-start time of load_models.")
+    parser.add_argument('--model-dir', default=os.getenv('MODEL_DIR', 'app/models'))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {
+        "pickles": measure(args.model_dir, False, args.runs),
+        "bundle": measure(args.model_dir, True, args.runs)
+    }
+    if os.path.exists(os.path.join(args.model_dir, 'static', 'table.npy')):
+        results["static"] = measure(args.model_dir, True, args.runs, static=True)
+    print(json.dumps(results, indent=2))
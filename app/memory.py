@@ -0,0 +1,55 @@
+import gc
+import os
+from glyphs import release_page
+
+# Bounded-memory processing. pdfplumber keeps every page's parsed objects until
+# the PDF is closed, so RSS grows with the page count. With $LOW_MEMORY=1
+# (implied by $MAX_RSS_MB) page loops go through iter_pages, which drops each
+# page's caches as soon as the loop moves on and then checks the RSS ceiling.
+
+
+class MemoryLimitExceeded(MemoryError):
+    pass
+
+
+def rss_limit_mb():
+    limit = os.getenv('MAX_RSS_MB')
+    return float(limit) if limit else None
+
+
+def low_memory_enabled():
+    return os.getenv('LOW_MEMORY', '0') == '1' or rss_limit_mb() is not None
+
+
+def rss_mb():
+    """Current resident set size; the peak where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check_rss(page_num=None):
+    limit = rss_limit_mb()
+    if limit is None or rss_mb() <= limit:
+        return
+    gc.collect()
+    rss = rss_mb()
+    if rss > limit:
+        raise MemoryLimitExceeded(f"RSS {rss:.0f} MB exceeds MAX_RSS_MB={limit:g} after page {page_num}")
+
+
+def page_done(page, page_num):
+    """Release `page` and enforce the ceiling when running in low-memory mode."""
+    if low_memory_enabled():
+        release_page(page)
+        check_rss(page_num)
+
+
+def iter_pages(pdf):
+    """enumerate(pdf.pages, 1), releasing each page once the caller is done with it."""
+    for page_num, page in enumerate(pdf.pages, 1):
+        yield page_num, page
+        page_done(page, page_num)
@@ -0,0 +1,229 @@
+import io
+import os
+import json
+import asyncio
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from pdfminer.pdfparser import PDFSyntaxError
+from utils import load_models
+from main import process_pdf
+from driver import PIPELINE_MODELS
+
+# Long-running extraction service. Models are loaded once and kept warm;
+# requests are processed on a thread pool, and the MiniLM encodes they need are
+# funnelled through one MicroBatcher that merges texts from concurrent requests
+# into shared batches.
+#
+#   POST /extract   body: PDF bytes, or JSON {"path": "..."} with
+#                   Content-Type: application/json -> process_pdf's JSON
+#   GET  /health    -> {"status": "ok", "batcher": {...}}
+#
+# The same HTTP/1.1 protocol is served on TCP or on a Unix socket:
+#   curl --data-binary @doc.pdf http://127.0.0.1:8080/extract
+#   curl --unix-socket /tmp/extract.sock --data-binary @doc.pdf http://localhost/extract
+
+
+class MicroBatcher:
+    """Drop-in for the embedder whose encode() calls are coalesced across threads.
+
+    The first pending call opens a batch that closes once `max_batch` texts
+    are queued or `max_wait` seconds have passed; the batch is encoded in one
+    call on a dedicated thread and each caller gets its own rows back. Batches
+    never exceed `max_batch` texts: larger calls are split into chunks, and a
+    chunk that does not fit opens the next batch.
+    """
+
+    def __init__(self, encoder, loop, max_batch=64, max_wait=0.01):
+        self.encoder = encoder
+        self.loop = loop
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='minilm')
+        self.batches = 0
+        self.texts = 0
+        self.calls = 0
+
+    def encode(self, texts, **kwargs):
+        """Called from request threads; blocks until the batch holding `texts` is encoded."""
+        return asyncio.run_coroutine_threadsafe(self._submit(list(texts)), self.loop).result()
+
+    async def _submit(self, texts):
+        self.calls += 1
+        futures = []
+        for start in range(0, max(len(texts), 1), self.max_batch):
+            future = self.loop.create_future()
+            await self.queue.put((texts[start:start + self.max_batch], future))
+            futures.append(future)
+        parts = await asyncio.gather(*futures)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    async def run(self):
+        carry = None
+        while True:
+            pending = [carry if carry is not None else await self.queue.get()]
+            carry = None
+            size = len(pending[0][0])
+            deadline = self.loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + len(item[0]) > self.max_batch:
+                    carry = item
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            try:
+                vectors = await self.loop.run_in_executor(self.executor, self.encoder.encode, texts)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for item_texts, future in pending:
+                future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "calls": self.calls,
+            "mean_batch": round(self.texts / self.batches, 2) if self.batches else 0.0
+        }
+
+
+class ExtractionService:
+    def __init__(self, models, workers=4, max_batch=64, max_wait=0.01):
+        self.models = models
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='extract')
+        self.batcher = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # Load everything now so request threads never race to load a model.
+        self.models.preload(*PIPELINE_MODELS, 'embedding_cache')
+        self.batcher = MicroBatcher(self.models['minilm'], loop, self.max_batch, self.max_wait)
+        self.models['minilm'] = self.batcher
+        loop.create_task(self.batcher.run())
+
+    def extract(self, body, content_type):
+        if content_type.startswith('application/json'):
+            source = json.loads(body)['path']
+        else:
+            source = io.BytesIO(body)
+        return process_pdf(source, self.models)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.dispatch(method, path, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, headers, body):
+        if method == 'GET' and path == '/health':
+            return 200, {"status": "ok", "workers": self.workers, "batcher": self.batcher.stats()}
+        if method != 'POST' or path != '/extract':
+            return 404, {"error": f"no route for {method} {path}"}
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self.executor, self.extract, body, headers.get('content-type', 'application/pdf'))
+        except (KeyError, ValueError, OSError, PDFSyntaxError) as e:
+            return 400, {"error": repr(e)}
+        except Exception as e:
+            return 500, {"error": repr(e)}
+        return 200, result
+
+
+async def _read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', '0')))
+    return method, path, headers, body
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+def _write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+
+
+async def serve(service, host='127.0.0.1', port=8080, socket_path=None):
+    await service.start()
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(service.handle, path=socket_path)
+        where = socket_path
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        where = f"http://{host}:{port}"
+    print(f"Serving on {where} ({service.workers} workers, max batch {service.max_batch}, "
+          f"max wait {service.max_wait * 1000:g} ms)", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve PDF outline extraction with warm models.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8080')))
+    parser.add_argument('--socket', help="listen on this Unix socket instead of TCP")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', '4')),
+                        help="concurrent requests (default: $WORKERS or 4)")
+    parser.add_argument('--max-batch', type=int, default=64, help="texts per shared MiniLM batch")
+    parser.add_argument('--max-wait-ms', type=float, default=10.0,
+                        help="how long a batch waits for texts from other requests")
+    args = parser.parse_args()
+
+    models = load_models(Path(os.getenv('MODEL_DIR', 'app/models')))
+    service = ExtractionService(models, args.workers, args.max_batch, args.max_wait_ms / 1000)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,84 @@
+import math
+import pdfplumber
+from collections import Counter
+from utils import body_font_size, is_above_body_size
+from main import bookmark_result, classify_candidates, iter_page_windows
+from incremental import _parse_page
+from instrument import NULL_PROFILER, Profiler
+from memory import page_done
+
+# Intra-document parallelism for very large PDFs. Pages are split into
+# contiguous ranges; each pool worker opens the PDF itself and parses,
+# groups, merges and filters its range into per-page entries (the same ones
+# the incremental page cache stores). The parent merges the font histograms in
+# page order, so every page is judged against the one document body size,
+# and classifies the candidates exactly as process_pdf does.
+
+# Smallest range worth the cost of opening the PDF in another process.
+MIN_SHARD_PAGES = 4
+
+
+def shard_ranges(page_nums, shards):
+    """Split the page numbers into at most `shards` contiguous runs."""
+    shards = max(1, min(shards, math.ceil(len(page_nums) / MIN_SHARD_PAGES)))
+    size = math.ceil(len(page_nums) / shards) if page_nums else 0
+    return [page_nums[i:i + size] for i in range(0, len(page_nums), size)] if size else []
+
+
+def _parse_shard(pdf_path, page_nums, profile=False):
+    stats = Counter()
+    profiler = Profiler() if profile else NULL_PROFILER
+    entries = []
+    with profiler.stage('open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        for page_num in page_nums:
+            page = pdf.pages[page_num - 1]
+            entries.append(_parse_page(page, page_num, "", stats, profiler))
+            page_done(page, page_num)
+    return entries, stats, profiler.report() if profile else None
+
+
+def parse_pages(pdf_path, page_nums, pool, shards, stats=None, profiler=NULL_PROFILER):
+    """Per-page entries for `page_nums` (in that order), parsed across `pool`."""
+    jobs = [(pdf_path, run, profiler.enabled) for run in shard_ranges(list(page_nums), shards)]
+    entries = []
+    for shard_entries, shard_stats, report in pool.starmap(_parse_shard, jobs):
+        entries.extend(shard_entries)
+        if stats is not None:
+            stats.update(shard_stats)
+            stats['pages_parsed'] += len(shard_entries)
+        if report is not None:
+            profiler.merge(report)
+    return entries
+
+
+def process_pdf_sharded(pdf_path, models, pool, shards, batch_pages=None, stats=None,
+                        profiler=NULL_PROFILER):
+    """process_pdf with the page parsing spread over `shards` ranges on `pool`."""
+    with profiler.stage('open'):
+        pdf = pdfplumber.open(pdf_path)
+    with pdf:
+        result = bookmark_result(pdf, stats, profiler)
+        if result is not None:
+            return result
+        n_pages = len(pdf.pages)
+
+    entries = parse_pages(pdf_path, range(1, n_pages + 1), pool, shards, stats, profiler)
+
+    font_counter = Counter()
+    pending = []
+    for page_num, entry in enumerate(entries, 1):
+        font_counter.update(dict(entry['sizes']))
+        pending.extend(dict(c, page=page_num) for c in entry['candidates'])
+    body_size = body_font_size(font_counter)
+    candidates = [c for c in pending if is_above_body_size(c['block'], body_size)]
+    if stats is not None:
+        stats['pages'] += n_pages
+        stats['pending'] += len(pending)
+
+    outline = []
+    for window in iter_page_windows(candidates, batch_pages):
+        outline.extend(classify_candidates(window, body_size, models, stats, profiler))
+
+    return {"title": entries[0]['title'] if entries else "", "outline": outline, "source": "model"}
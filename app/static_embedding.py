@@ -0,0 +1,82 @@
+import os
+import json
+import numpy as np
+from itertools import chain
+
+# Static token embeddings distilled from MiniLM. Every vocabulary token is
+# embedded once, on its own, by the full transformer; a text is then embedded
+# as the normalized mean of its tokens' rows. Headings are a handful of
+# tokens, so this trades some context sensitivity for a table lookup, and
+# inference needs only numpy and the `tokenizers` library (no torch).
+
+TABLE_FILE = 'table.npy'
+TOKENIZER_FILE = 'tokenizer.json'
+
+
+class StaticEmbedder:
+    """Drop-in for SentenceTransformer.encode backed by a memory-mapped token table."""
+
+    def __init__(self, static_dir):
+        from tokenizers import Tokenizer
+        self.table = np.load(os.path.join(static_dir, TABLE_FILE), mmap_mode='r')
+        self.tokenizer = Tokenizer.from_file(os.path.join(static_dir, TOKENIZER_FILE))
+        self.tokenizer.no_padding()
+        self.tokenizer.no_truncation()
+
+    def get_sentence_embedding_dimension(self):
+        return self.table.shape[1]
+
+    def encode(self, texts, batch_size=None, **kwargs):
+        encodings = self.tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return self.pool([encoding.ids for encoding in encodings])
+
+    def pool(self, token_ids):
+        """L2-normalized mean of the table rows of each id list (zeros when empty)."""
+        n = len(token_ids)
+        lengths = np.fromiter(map(len, token_ids), dtype=np.int64, count=n)
+        ids = np.fromiter(chain.from_iterable(token_ids), dtype=np.int64, count=int(lengths.sum()))
+        pooled = np.zeros((n, self.table.shape[1]), dtype=np.float32)
+        nonempty = lengths > 0
+        if ids.size:
+            offsets = np.cumsum(lengths) - lengths
+            pooled[nonempty] = np.add.reduceat(self.table[ids], offsets[nonempty], axis=0)
+        # The mean and the sum have the same direction, so normalizing the sum suffices.
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        np.divide(pooled, norms, out=pooled, where=norms > 0)
+        return pooled
+
+
+def distill_static(embedder, static_dir, batch_size=1024):
+    """Write `embedder`'s token table and tokenizer to `static_dir`.
+
+    Each token id is run through the transformer and pooling as
+    `[CLS] token [SEP]`, which is what a one-token text looks like to MiniLM.
+    """
+    import torch
+
+    os.makedirs(static_dir, exist_ok=True)
+    tokenizer = embedder.tokenizer
+    vocab_size = len(tokenizer)
+    dim = embedder.get_sentence_embedding_dimension()
+    tmp_path = os.path.join(static_dir, 'table.tmp.npy')
+    table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(vocab_size, dim))
+
+    embedder.eval()
+    with torch.no_grad():
+        for start in range(0, vocab_size, batch_size):
+            ids = torch.arange(start, min(start + batch_size, vocab_size))
+            input_ids = torch.stack([torch.full_like(ids, tokenizer.cls_token_id), ids,
+                                     torch.full_like(ids, tokenizer.sep_token_id)], dim=1)
+            features = {'input_ids': input_ids,
+                        'attention_mask': torch.ones_like(input_ids),
+                        'token_type_ids': torch.zeros_like(input_ids)}
+            features = {key: value.to(embedder.device) for key, value in features.items()}
+            table[start:start + len(ids)] = embedder(features)['sentence_embedding'].cpu().numpy()
+    table.flush()
+    del table
+    os.replace(tmp_path, os.path.join(static_dir, TABLE_FILE))
+
+    tokenizer.backend_tokenizer.save(os.path.join(static_dir, TOKENIZER_FILE))
+    with open(os.path.join(static_dir, 'meta.json'), 'w') as f:
+        json.dump({'vocab_size': vocab_size, 'dim': dim}, f, indent=2)
+    return StaticEmbedder(static_dir)
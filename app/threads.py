@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+
+# CPU thread budget. Torch sizes its intra-op pool (and numpy's BLAS its own)
+# to every core of the machine, so N extractor processes side by side run N
+# times as many busy threads as there are cores. The budget splits the cores
+# between worker processes and the torch/BLAS threads of each worker; it is
+# applied before MiniLM is loaded and again in every worker process.
+
+# Read by OpenMP, MKL, OpenBLAS and friends when they initialise.
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+_applied = None
+
+
+def available_cores():
+    """$CORES, else the CPUs this process may run on."""
+    cores = int(os.getenv('CORES', '0'))
+    if cores > 0:
+        return cores
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def tuned_path():
+    return os.getenv('THREAD_BUDGET_FILE', 'thread_budget.json')
+
+
+def load_tuned(cores):
+    """The split saved by `benchmark.py --tune-threads` for `cores`, if any."""
+    try:
+        with open(tuned_path()) as f:
+            tuned = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return tuned if tuned.get('cores') == cores else None
+
+
+def save_tuned(cores, workers, threads, **extra):
+    tuned = {'cores': cores, 'workers': workers, 'threads': threads, **extra}
+    tmp_path = f"{tuned_path()}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(tuned, f, indent=2)
+    os.replace(tmp_path, tuned_path())
+    return tuned
+
+
+def thread_budget(workers=None, threads=None, cores=None):
+    """(workers, threads per worker) for `cores` (default: available_cores()).
+
+    Unset values come from $WORKERS / $THREADS, then from the tuned split when
+    it was measured for the same number of workers, and otherwise the cores
+    are divided evenly between the workers.
+    """
+    cores = cores or available_cores()
+    tuned = load_tuned(cores)
+    workers = workers or int(os.getenv('WORKERS', '0')) or (tuned['workers'] if tuned else 1)
+    threads = threads or int(os.getenv('THREADS', '0'))
+    if not threads:
+        if tuned and tuned['workers'] == workers:
+            threads = tuned['threads']
+        else:
+            threads = max(1, cores // workers)
+    return workers, threads
+
+
+def candidate_splits(cores):
+    """(workers, threads) splits worth trying: powers of two plus one worker per core."""
+    workers = {1, cores}
+    w = 2
+    while w < cores:
+        workers.add(w)
+        w *= 2
+    return [(w, max(1, cores // w)) for w in sorted(workers)]
+
+
+def apply_thread_budget(threads):
+    """Limit torch and BLAS in this process to `threads` threads.
+
+    Libraries that are not loaded yet pick the limit up from the environment.
+    """
+    global _applied
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        threadpool_limits(threads)
+    _applied = threads
+    return threads
+
+
+def applied_threads():
+    return _applied
@@ -1,154 +1,349 @@
 import os
-import re
-import joblib
+import json
+import hashlib
 import numpy as np
 from collections import Counter
-from sentence_transformers import SentenceTransformer
+from operator import itemgetter
+from embedding_cache import EmbeddingCache
+from instrument import NULL_PROFILER
+from glyphs import page_chars
+from memory import iter_pages
+from threads import applied_threads, apply_thread_budget, thread_budget
+from blocks import BlockTable, FOOTER_RE, LEVEL_RE, text_stats
 
-def load_models(model_dir):
-    return {
-        'minilm': SentenceTransformer(str(model_dir / 'minilm')),
-        'pca': joblib.load(os.path.join(model_dir, 'pca.pkl')),
-        'classifier_head': joblib.load(os.path.join(model_dir, 'classifier_head.pkl')),
-        'classifier_level': joblib.load(os.path.join(model_dir, 'classifier_level.pkl'))
-    }
+def model_fingerprint(model_dir):
+    """Hash of the file names, sizes and mtimes under `model_dir`."""
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, model_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
 
-def compute_body_font_size(pdf):
+class LazyModels(dict):
+    """Model dict whose entries are loaded on first access.
+
+    Heavy libraries (torch via sentence_transformers, sklearn via joblib) are
+    only imported once a stage actually needs the corresponding model.
+    """
+
+    def __init__(self, loaders, **loaded):
+        super().__init__(**loaded)
+        self.loaders = loaders
+
+    def __missing__(self, key):
+        value = self[key] = self.loaders[key]()
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.loaders
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def preload(self, *keys):
+        for key in keys or self.loaders:
+            if key in self:
+                self[key]
+        return self
+
+def quantize_embedder(embedder):
+    """Dynamically quantize the embedder's Linear layers to int8 for CPU inference."""
+    import torch
+    return torch.quantization.quantize_dynamic(embedder, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_embedder(model_dir, int8=False):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if applied_threads():
+        torch.set_num_threads(applied_threads())
+    embedder = SentenceTransformer(str(model_dir / 'minilm'))
+    return quantize_embedder(embedder) if int8 else embedder
+
+def load_static_embedder(static_dir):
+    from static_embedding import StaticEmbedder
+    return StaticEmbedder(static_dir)
+
+def static_enabled():
+    return os.getenv('EMBEDDING', 'minilm') == 'static'
+
+def _load_pickle(path):
+    import joblib
+    return joblib.load(path)
+
+def _load_projection(models):
+    from compiled import FusedProjection
+    return FusedProjection.from_pca(models['pca'])
+
+def load_models(model_dir, cache_dir=None, int8=None, bundle=None, threads=None, static=None):
+    """Models from `model_dir`, each loaded lazily on first use.
+
+    PCA and forests come from the NumPy bundle in `model_dir/bundle` when it
+    exists (disable with `bundle=False` or $MODEL_BUNDLE=0), else from the pickles.
+    MiniLM encodes go through an in-memory LRU cache; `cache_dir` (or
+    $EMBED_CACHE_DIR) adds a persistent on-disk layer shared across runs.
+    `int8` (or $MINILM_INT8=1) swaps in a dynamically quantized MiniLM.
+    A structural classifier, when exported, enables the cascade. 'projection'
+    is the PCA fused into one float32 map, built from whichever PCA is loaded.
+    Torch and BLAS are limited to `threads` threads (default: the thread
+    budget of a single worker, see threads.py).
+
+    `static` (or $EMBEDDING=static) replaces MiniLM with the static token
+    table distilled by `train_model.py --static`; PCA and forests then come
+    from `model_dir/static`, trained on those embeddings, and torch is never
+    imported. The embedder keeps the 'minilm' key.
+    """
+    apply_thread_budget(threads or thread_budget(workers=1)[1])
+    cache_dir = cache_dir or os.getenv('EMBED_CACHE_DIR')
+    if static is None:
+        static = static_enabled()
+    if int8 is None:
+        int8 = os.getenv('MINILM_INT8', '0') == '1' and not static
+    head_dir = model_dir / 'static' if static else model_dir
+    bundle_dir = head_dir / 'bundle'
+    if bundle is None:
+        bundle = os.getenv('MODEL_BUNDLE', '1') != '0'
+    bundle = bundle and os.path.exists(bundle_dir / 'meta.json')
+
+    if static:
+        fingerprint = 'static:' + model_fingerprint(head_dir)
+        if cache_dir:
+            cache_dir = os.path.join(cache_dir, 'static')
+        loaders = {'minilm': lambda: load_static_embedder(head_dir)}
+    else:
+        fingerprint = model_fingerprint(model_dir / 'minilm')
+        if int8:
+            fingerprint += ':int8'
+            if cache_dir:
+                cache_dir = os.path.join(cache_dir, 'int8')
+        loaders = {'minilm': lambda: load_embedder(model_dir, int8)}
+
+    if bundle:
+        from compiled import Bundle
+        compiled = Bundle(bundle_dir)
+        loaders['pca'] = compiled.pca
+        loaders['classifier_head'] = lambda: compiled.forest('classifier_head')
+        loaders['classifier_level'] = lambda: compiled.forest('classifier_level')
+        if compiled.has('classifier_struct'):
+            loaders['classifier_struct'] = compiled.cascade
+    else:
+        for name in ('pca', 'classifier_head', 'classifier_level', 'classifier_struct'):
+            path = os.path.join(head_dir, f"{name}.pkl")
+            if name != 'classifier_struct' or os.path.exists(path):
+                loaders[name] = lambda path=path: _load_pickle(path)
+
+    models = LazyModels(loaders, embedding_cache=EmbeddingCache(
+        fingerprint,
+        max_entries=int(os.getenv('EMBED_CACHE_SIZE', '10000')),
+        cache_dir=cache_dir,
+        disk_capacity=int(os.getenv('EMBED_CACHE_DISK_ENTRIES', '100000'))
+    ))
+    loaders['projection'] = lambda: _load_projection(models)
+    return models
+
+def encode_texts(texts, models):
+    cache = models.get('embedding_cache')
+    if cache is None:
+        return models['minilm'].encode(texts)
+    return cache.encode(texts, lambda missing: models['minilm'].encode(missing))
+
+def body_font_size(font_counter):
+    return font_counter.most_common(1)[0][0] if font_counter else 11
+
+def compute_body_font_size(pdf, profiler=NULL_PROFILER):
     font_counter = Counter()
-    for page in pdf.pages:
+    for page_num, page in iter_pages(pdf):
         try:
-            for char in page.chars:
-                font_counter[char["size"]] += 1
+            with profiler.stage('body_size', page_num):
+                for char in page_chars(page):
+                    font_counter[char["size"]] += 1
         except Exception:
             continue
-    return font_counter.most_common(1)[0][0] if font_counter else 11
+    return body_font_size(font_counter)
 
-def group_text_blocks(page, tolerance=3):
-    if not hasattr(page, 'chars') or not page.chars:
-        return []
+_CHAR_FIELDS = itemgetter('text', 'size', 'top', 'bottom', 'x0', 'x1')
+
+def group_text_table(page, tolerance=3, font_counter=None):
+    """Group a page's chars into lines; optionally tally their sizes into `font_counter`.
+
+    Char attributes are loaded into arrays once; lines are formed with a single
+    lexsort and reduced per segment into a BlockTable. Lines keep the order in
+    which they first appear on the page and chars within a line are ordered by
+    x0 (stable).
+    """
+    chars = page_chars(page)
+    if not chars:
+        return BlockTable.from_blocks([])
+
+    n = len(chars)
+    texts, sizes, top, bottom, x0, x1 = zip(*map(_CHAR_FIELDS, chars))
+    if font_counter is not None:
+        font_counter.update(sizes)
 
-    lines = {}
-    for char in page.chars:
-        key = round(char['top'] / tolerance) * tolerance
-        lines.setdefault(key, []).append(char)
-
-    blocks = []
-    for y, chars in lines.items():
-        chars.sort(key=lambda c: c['x0'])
-        text = ''.join(c['text'] for c in chars)
-        font_size = max(c['size'] for c in chars)
-        x0 = min(c['x0'] for c in chars)
-        top = min(c['top'] for c in chars)
-        x1 = max(c['x1'] for c in chars)
-        bottom = max(c['bottom'] for c in chars)
-
-        blocks.append({
-            'text': text,
-            'size': font_size,
-            'x0': x0,
-            'top': top,
-            'x1': x1,
-            'bottom': bottom
-        })
-
-    return blocks
+    size = np.array(sizes, dtype=np.float64)
+    top = np.array(top, dtype=np.float64)
+    bottom = np.array(bottom, dtype=np.float64)
+    x0 = np.array(x0, dtype=np.float64)
+    x1 = np.array(x1, dtype=np.float64)
+
+    # np.round rounds half to even, like the builtin round() used for line keys.
+    keys = np.round(top / tolerance)
+    _, first_seen, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    line_rank = np.empty(len(first_seen), dtype=np.int64)
+    line_rank[np.argsort(first_seen, kind='stable')] = np.arange(len(first_seen))
+    line = line_rank[inverse.ravel()]
+
+    order = np.lexsort((x0, line))
+    sorted_line = line[order]
+    line_start = np.empty(n, dtype=bool)
+    line_start[0] = True
+    np.not_equal(sorted_line[1:], sorted_line[:-1], out=line_start[1:])
+    starts = np.flatnonzero(line_start)
+    bounds = starts.tolist() + [n]
+
+    texts = list(map(texts.__getitem__, order.tolist()))
+    return BlockTable(
+        [''.join(texts[s:e]) for s, e in zip(bounds, bounds[1:])],
+        np.maximum.reduceat(size[order], starts),
+        np.minimum.reduceat(x0[order], starts),
+        np.minimum.reduceat(top[order], starts),
+        np.maximum.reduceat(x1[order], starts),
+        np.maximum.reduceat(bottom[order], starts)
+    )
+
+def group_text_blocks(page, tolerance=3, font_counter=None):
+    """group_text_table as a list of block dicts."""
+    return group_text_table(page, tolerance, font_counter).to_blocks()
 
 def merge_blocks_if_continuous(blocks, page_height, istitle, gap_threshold=10):
-    merged = []
-    i = 0
     if istitle:
         gap_threshold = page_height
-    while i < len(blocks):
-        current = blocks[i]
-        while i + 1 < len(blocks):
-            next_block = blocks[i + 1]
-            is_same_size = abs(current['size'] - next_block['size']) < 0.1
-            gap = next_block['top'] - current['bottom']
-            has_no_interference = gap < gap_threshold
-
-            if is_same_size and has_no_interference:
-                current['text'] += ' ' + next_block['text']
-                current['bottom'] = next_block['bottom']
-                current['x1'] = max(current['x1'], next_block['x1'])
-                i += 1
-            else:
-                break
-        merged.append(current)
-        i += 1
-    return merged
-
-def extract_title_blocks(first_page):
-    blocks = group_text_blocks(first_page)
-    if not blocks:
+    return BlockTable.from_blocks(blocks).merge_continuous(gap_threshold).to_blocks()
+
+def extract_title_blocks(first_page, blocks=None):
+    """The merged block of the largest text in the top fifth of the first page.
+
+    `blocks` may be a BlockTable or a list of block dicts; it is not modified.
+    """
+    if blocks is None:
+        blocks = group_text_table(first_page)
+    if not len(blocks):
         return []
+    if not isinstance(blocks, BlockTable):
+        blocks = BlockTable.from_blocks(blocks)
+
+    in_top = blocks.top < first_page.height * 0.2
+    top_blocks = blocks.take(in_top if in_top.any() else np.arange(min(5, len(blocks))))
 
-    top_blocks = [b for b in blocks if b['top'] < first_page.height * 0.2]
-    if not top_blocks:
-        top_blocks = blocks[:5]
+    top_blocks = top_blocks.take(np.lexsort((top_blocks.top, -top_blocks.size)))
+    return top_blocks.merge_continuous(first_page.height).block(0)
 
-    top_blocks.sort(key=lambda b: (-b['size'], b['top']))
-    merged = merge_blocks_if_continuous(top_blocks, first_page.height, True)
-    # print(merged)
-    return merged[0]
+def structural_features(block, prev_block, next_block, body_size, page_width, page_height):
+    candidate = {"block": block, "prev": prev_block, "next": next_block,
+                 "width": page_width, "height": page_height}
+    return structural_matrix([candidate], body_size)[0].tolist()
 
 def extract_features(block, prev_block, next_block, body_size, page_width, page_height, models):
-    position_x = (block['x0'] + block['x1']) / 2 / page_width if page_width else 0.5
-    position_y = block['top'] / page_height if page_height else 0.5
-
-    features = [
-        block['size'] / body_size if body_size else 1.0,
-        position_x,
-        position_y,
-        1 if 0.4 < position_x < 0.6 else 0,
-        len(block['text']),
-        sum(1 for c in block['text'] if c.isupper()) / max(1, len(block['text'])),
-        sum(1 for c in block['text'] if c.isdigit()) / max(1, len(block['text'])),
-        1 if any(c in '.,;:!?' for c in block['text']) else 0,
-        (block['top'] - prev_block['bottom']) if prev_block else 1000,
-        (next_block['size'] / body_size) if next_block and body_size else 0
-    ]
-
-    embedding = models['minilm'].encode([block['text']])[0]
-    full_features = features + embedding.tolist()
-    return models['pca'].transform([full_features])[0]
+    features = structural_features(block, prev_block, next_block, body_size, page_width, page_height)
 
-def is_valid_heading(block, page_num, body_size):
+    return project_features(np.array([features]), [block['text']], models)[0]
+
+N_STRUCT = 10
+
+def structural_matrix(candidates, body_size):
+    """Structural feature rows for `candidates`, computed column by column.
+
+    Columns: size / body size, horizontal centre and top as page fractions,
+    centred flag, text length, upper-case and digit ratios, punctuation flag,
+    gap to the previous block (1000 without one) and next block's size ratio.
+    """
+    n = len(candidates)
+    blocks = [c['block'] for c in candidates]
+    size, x0, x1, top = (np.array([b[field] for b in blocks], dtype=np.float64)
+                         for field in ('size', 'x0', 'x1', 'top'))
+    width = np.array([c['width'] or 0 for c in candidates], dtype=np.float64)
+    height = np.array([c['height'] or 0 for c in candidates], dtype=np.float64)
+    has_prev = np.array([bool(c['prev']) for c in candidates], dtype=bool)
+    prev_bottom = np.array([c['prev']['bottom'] if c['prev'] else 0 for c in candidates], dtype=np.float64)
+    has_next = np.array([bool(c['next']) for c in candidates], dtype=bool)
+    next_size = np.array([c['next']['size'] if c['next'] else 0 for c in candidates], dtype=np.float64)
+    lengths, upper, digits, punct = text_stats([b['text'] for b in blocks])
+
+    position_x = np.divide((x0 + x1) / 2, width, out=np.full(n, 0.5), where=width != 0)
+    position_y = np.divide(top, height, out=np.full(n, 0.5), where=height != 0)
+    letters = np.maximum(1, lengths)
+
+    features = np.empty((n, N_STRUCT), dtype=np.float64)
+    features[:, 0] = size / body_size if body_size else 1.0
+    features[:, 1] = position_x
+    features[:, 2] = position_y
+    features[:, 3] = (0.4 < position_x) & (position_x < 0.6)
+    features[:, 4] = lengths
+    features[:, 5] = upper / letters
+    features[:, 6] = digits / letters
+    features[:, 7] = punct
+    features[:, 8] = np.where(has_prev, top - prev_bottom, 1000)
+    features[:, 9] = np.where(has_next, next_size / body_size, 0) if body_size else 0
+    return features
+
+def project_features(structural, texts, models, profiler=NULL_PROFILER):
+    with profiler.stage('encode'):
+        embeddings = encode_texts(texts, models)
+    with profiler.stage('pca'):
+        projection = models.get('projection')
+        if projection is not None:
+            return projection.project(structural, embeddings)
+        full_features = np.hstack([structural, np.asarray(embeddings, dtype=np.float64)])
+        return models['pca'].transform(full_features)
+
+def extract_features_batch(candidates, body_size, models):
+    """Feature rows for many candidate blocks with one encode and one PCA call."""
+    structural = structural_matrix(candidates, body_size)
+    return project_features(structural, [c['block']['text'] for c in candidates], models)
+
+def structural_cascade(structural, models):
+    """Settle confident candidates from structural features alone.
+
+    Returns (decided, is_heading) boolean arrays; undecided rows need the
+    embedding path. Without a structural classifier nothing is decided.
+    """
+    n = len(structural)
+    cascade = models.get('classifier_struct')
+    if cascade is None:
+        return np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+
+    proba = cascade['model'].predict_proba(structural)[:, 1]
+    is_heading = proba >= cascade['high']
+    decided = is_heading | (proba <= cascade['low'])
+    return decided, is_heading
+
+def is_valid_heading_text(block):
     text = block['text'].strip()
 
     if not text or len(text) > 150:
         return False
 
-    footer_patterns = [
-        r"Page \d+ of \d+",
-        r"Page \d+",
-        r"Version \d{4}",
-        r"© .+",
-        r"\d{4}-\d{2}-\d{2}",
-        r"\d{1,2}/\d{1,2}/\d{4}",
-        r"Copyright",
-        r"Confidential"
-    ]
-    if any(re.search(p, text) for p in footer_patterns):
+    # Page numbers, dates, copyright and confidentiality lines.
+    if FOOTER_RE.search(text):
         return False
 
-    if block['size'] / body_size < 1.0:
-        return False
+    return True
 
-    if re.match(r"^\d+\.", text):
-        return True
+def is_above_body_size(block, body_size):
+    return block['size'] / body_size >= 1.0
 
-    return True
+def is_valid_heading(block, page_num, body_size):
+    return is_valid_heading_text(block) and is_above_body_size(block, body_size)
 
 def determine_heading_level(block, body_size):
     text = block['text'].strip()
     size_ratio = block['size'] / body_size
 
-    if re.match(r"^\d+\.\s+", text):
-        return "H1"
-    if re.match(r"^\d+\.\d+\s+", text):
-        return "H2"
-    if re.match(r"^\d+\.\d+\.\d+\s+", text):
-        return "H3"
+    numbered = LEVEL_RE.match(text)
+    if numbered:
+        return numbered.lastgroup
 
     if size_ratio > 1.8:
         return "H1"
@@ -158,3 +353,9 @@ def determine_heading_level(block, body_size):
 
 def is_header_footer(block, page_height):
     return block['top'] < page_height * 0.05 or block['bottom'] > page_height * 0.9
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
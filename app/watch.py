@@ -0,0 +1,245 @@
+import os
+import time
+import heapq
+import signal
+import itertools
+from collections import deque
+from pathlib import Path
+import numpy as np
+import pdfplumber
+from pdfminer.pdftypes import resolve1
+from utils import load_models, model_fingerprint, write_json_atomic
+from driver import (PIPELINE_MODELS, WorkerPool, _flush_cache, _process_one, outline_source, output_file,
+                    page_cache_options)
+from incremental import Manifest, extractor_settings, file_sha256
+from threads import thread_budget
+
+# Hot-folder daemon. The input directory is polled; a PDF counts as arrived
+# once its size and mtime hold still for one poll interval (so half-copied
+# files are never read). Jobs are costed by page count and run shortest job
+# first, with aging so a large file is not starved by a stream of small ones.
+# Models stay loaded for the life of the daemon; outputs are written
+# atomically and recorded in the same manifest as batch runs.
+
+
+def page_count(pdf_path):
+    """Pages from the page tree root's /Count, without walking the page tree."""
+    with pdfplumber.open(pdf_path) as pdf:
+        try:
+            count = resolve1(resolve1(pdf.doc.catalog['Pages']).get('Count'))
+            if isinstance(count, int) and count > 0:
+                return count
+        except Exception:
+            pass
+        return len(pdf.pages)
+
+
+class ShortestJobFirst:
+    """Pending jobs, cheapest first.
+
+    Waiting lowers a job's cost by `aging` pages per second. Since every
+    queued job ages at the same rate, the order is fixed at arrival:
+    pages - aging * (now - arrival) ranks jobs like pages + aging * arrival.
+    """
+
+    def __init__(self, aging=2.0):
+        self.aging = aging
+        self.heap = []
+        self.order = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, job):
+        heapq.heappush(self.heap, (job['pages'] + self.aging * job['arrival'], next(self.order), job))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[-1]
+
+
+class HotFolder:
+    def __init__(self, input_dir, output_dir, model_dir, workers=None, poll=1.0, aging=2.0,
+                 batch_pages=None, window=1000):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.model_dir = model_dir
+        self.workers, self.threads = thread_budget(workers)
+        self.poll = poll
+        self.queue = ShortestJobFirst(aging)
+
+        self.manifest = Manifest(output_dir)
+        self.model_version = model_fingerprint(model_dir)
+        self.settings = extractor_settings()
+        self.options = {'batch_pages': batch_pages, 'profile': False, 'ndjson': None, 'shards': 1,
+                        'threads': self.threads,
+                        **page_cache_options(output_dir, self.model_version, self.settings)}
+
+        self.seen = {}       # name -> (size, mtime) of the version last queued
+        self.settling = {}   # name -> ((size, mtime), first seen, last change)
+        self.active = {}     # name -> job, queued or running
+        self.running = {}    # pdf path -> job on the pool
+        self.latencies = deque(maxlen=window)
+        self.counts = {'processed': 0, 'failed': 0, 'skipped': 0}
+        self.models = None
+        self.pool = None
+        self.stopping = False
+
+    # ─── Arrivals ───────────────────────────────────────────────────────────
+    def scan(self, now):
+        for entry in os.scandir(self.input_dir):
+            name = entry.name
+            if not name.lower().endswith('.pdf') or name in self.active or not entry.is_file():
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.seen.get(name) == signature:
+                continue
+            settling = self.settling.get(name)
+            if settling is None or settling[0] != signature:
+                # Still being written (or just appeared); the first sighting is the arrival.
+                self.settling[name] = (signature, settling[1] if settling else now, now)
+                continue
+            if now - settling[2] < self.poll:
+                continue
+            del self.settling[name]
+            self.seen[name] = signature
+            self.arrive(name, entry.path, settling[1])
+
+    def arrive(self, name, pdf_path, arrival):
+        output_path = output_file(self.output_dir, name)
+        sha256 = file_sha256(pdf_path)
+        if self.manifest.is_current(name, sha256, self.model_version, self.settings, output_path):
+            self.counts['skipped'] += 1
+            return
+        try:
+            pages = page_count(pdf_path)
+        except Exception:
+            # Unreadable; cheap to fail, and _process_one reports the error.
+            pages = 1
+        job = {'name': name, 'path': pdf_path, 'output': output_path, 'sha256': sha256,
+               'pages': pages, 'arrival': arrival}
+        self.active[name] = job
+        self.queue.push(job)
+
+    # ─── Execution ──────────────────────────────────────────────────────────
+    def dispatch(self):
+        """Start queued jobs on free workers; returns how many were started.
+
+        Without a pool one job runs in this process, and the folder is scanned
+        again before the next one is chosen.
+        """
+        if self.pool is None:
+            if not self.queue:
+                return 0
+            job = self.queue.pop()
+            result = _process_one(job['path'], job['output'], self.models, self.options)
+            _flush_cache(self.models)
+            self.finish(job, result, time.time())
+            return 1
+        started = 0
+        while self.queue and self.pool.free():
+            job = self.queue.pop()
+            self.running[job['path']] = job
+            self.pool.submit((job['path'], job['output']))
+            started += 1
+        return started
+
+    def collect(self, timeout=0):
+        """Finish the jobs the pool has returned, waiting up to `timeout` seconds.
+
+        A job whose worker died comes back failed; it is retried only once
+        the file changes.
+        """
+        if self.pool is None:
+            return
+        for (pdf_path, _), result in self.pool.results(timeout):
+            self.finish(self.running.pop(pdf_path), result, time.time())
+
+    def finish(self, job, result, finished):
+        _, error, seconds, stats, _ = result
+        del self.active[job['name']]
+        if error:
+            self.counts['failed'] += 1
+            print(f"Failed {job['name']}: {error}", flush=True)
+        else:
+            self.counts['processed'] += 1
+            self.latencies.append(finished - job['arrival'])
+            self.manifest.record(job['name'], job['sha256'], self.model_version, self.settings, job['output'],
+                                 source=outline_source(stats))
+            self.manifest.save()
+        status = self.status()
+        print(f"{job['name']}: {job['pages']} pages in {seconds:.2f}s, "
+              f"{finished - job['arrival']:.2f}s after arrival | queue {status['queue_depth']}, "
+              f"latency mean {status['latency_mean_s']}s p95 {status['latency_p95_s']}s", flush=True)
+        write_json_atomic(os.path.join(self.output_dir, 'watch_status.json'), status)
+
+    def status(self):
+        latencies = np.array(self.latencies)
+        return {
+            "queue_depth": len(self.queue),
+            "running": len(self.running),
+            "settling": len(self.settling),
+            **self.counts,
+            "latency_mean_s": round(float(latencies.mean()), 3) if len(latencies) else None,
+            "latency_p95_s": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+            "latency_window": len(latencies)
+        }
+
+    # ─── Main loop ──────────────────────────────────────────────────────────
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self, once=False):
+        """Poll until stopped (SIGINT/SIGTERM), or with `once` until the folder is drained."""
+        self.models = load_models(self.model_dir, threads=self.threads).preload(*PIPELINE_MODELS)
+        if self.workers > 1:
+            # Forked workers share the loaded models; others load their own.
+            self.pool = WorkerPool(self.workers, self.model_dir, self.options, models=self.models)
+        signal.signal(signal.SIGTERM, self.stop)
+        print(f"Watching {self.input_dir} with {self.workers} worker(s) x {self.threads} thread(s)", flush=True)
+        try:
+            while not self.stopping:
+                self.scan(time.time())
+                self.collect()
+                if self.dispatch():
+                    continue
+                if once and not (self.queue or self.running or self.settling):
+                    break
+                if self.running:
+                    # Returns as soon as a job finishes or its worker dies.
+                    self.collect(min(self.poll, 0.05))
+                else:
+                    time.sleep(min(self.poll, 0.05) if self.settling else self.poll)
+            # Let running jobs finish and record them; queued ones are picked up next start.
+            while self.running:
+                self.collect(0.05)
+        except KeyboardInterrupt:
+            if self.pool is not None:
+                self.pool.terminate()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+            _flush_cache(self.models)
+        return self.status()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Watch a folder and extract outlines as PDFs arrive.")
+    parser.add_argument('--input-dir', default='app/input')
+    parser.add_argument('--output-dir', default='app/output')
+    parser.add_argument('--workers', type=int,
+                        help="worker processes (default: $WORKERS, the tuned split, or 1)")
+    parser.add_argument('--poll', type=float, default=float(os.getenv('WATCH_POLL', '1.0')),
+                        help="seconds between folder scans; a file must be unchanged for one scan")
+    parser.add_argument('--aging', type=float, default=2.0,
+                        help="pages a queued job's cost drops per second of waiting")
+    parser.add_argument('--once', action='store_true', help="exit once the folder has been drained")
+    args = parser.parse_args()
+
+    model_dir = Path(os.getenv('MODEL_DIR', 'app/models'))
+    batch_pages = int(os.getenv('BATCH_PAGES', '0')) or None
+    os.makedirs(args.output_dir, exist_ok=True)
+    HotFolder(args.input_dir, args.output_dir, model_dir, args.workers, args.poll, args.aging,
+              batch_pages).run(args.once)
@@ -0,0 +1,318 @@
+# benchmark.py
+
+import os
+import sys
+import json
+import time
+import random
+import zlib
+import argparse
+import multiprocessing as mp
+import platform
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+from faker import Faker
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import Spacer, PageBreak, FrameBreak
+
+from generate_data import generate_pdf, make_paragraph, AVAILABLE_LANGS
+
+sys.path.insert(0, str(Path(__file__).parent / "app"))
+from utils import load_models
+from main import process_pdf
+from glyphs import BACKENDS
+from driver import PIPELINE_MODELS, run_batch
+from threads import available_cores, candidate_splits, save_tuned, tuned_path
+
+LOCALES = {'en': 'en_US', 'ja': 'ja_JP', 'ar': 'ar_EG', 'hi': 'hi_IN'}
+
+# ─── Memory ──────────────────────────────────────────────────────────────────
+def _status_kb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """Restart peak-RSS tracking (Linux clear_refs); returns False if unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    return _status_kb('VmHWM') / 1024
+
+def rss_mb():
+    return _status_kb('VmRSS') / 1024
+
+# ─── Corpus ──────────────────────────────────────────────────────────────────
+def build_document(path, pages, lang, layout, seed):
+    """Deterministic synthetic document of roughly `pages` pages."""
+    rng = random.Random(seed)
+    fake = Faker(LOCALES[lang])
+    fake.seed_instance(seed)
+
+    elems = [make_paragraph(fake.sentence(nb_words=rng.randint(2, 6)), 28, lang=lang, bold=True, align=1),
+             Spacer(1, 20)]
+    columns = 2 if layout == 'multi' else 1
+    for p in range(pages):
+        for col in range(columns):
+            if col:
+                elems.append(FrameBreak())
+            if rng.random() < 0.6:
+                elems.append(make_paragraph(fake.sentence(nb_words=rng.randint(2, 6)),
+                                            rng.choice([16, 18, 20]), lang=lang, bold=True))
+                elems.append(Spacer(1, 12))
+            for _ in range(rng.randint(2, 4) if columns == 1 else rng.randint(1, 2)):
+                elems.append(make_paragraph(fake.paragraph(nb_sentences=3), 11, lang=lang))
+                elems.append(Spacer(1, 8))
+        if p < pages - 1:
+            elems.append(PageBreak())
+
+    generate_pdf(path, elems, A4, layout, lang)
+
+def build_corpus(corpus_dir, pages, lang, layout, docs, seed=0):
+    """Paths of `docs` documents for one configuration, generated once and reused."""
+    corpus_dir = Path(corpus_dir)
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for d in range(docs):
+        path = corpus_dir / f"{lang}_{layout}_{pages}p_{seed + d}.pdf"
+        if not path.exists():
+            tmp_path = path.with_suffix('.tmp')
+            build_document(tmp_path, pages, lang, layout, seed=zlib.crc32(path.stem.encode()))
+            os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+# ─── Runs ────────────────────────────────────────────────────────────────────
+def run_config(paths, models, process=process_pdf):
+    reset_peak_rss()
+    start_rss = rss_mb()
+    latencies = []
+    totals = Counter()
+    for path in paths:
+        stats = Counter()
+        start = time.perf_counter()
+        process(str(path), models, stats=stats)
+        latencies.append(time.perf_counter() - start)
+        totals.update(stats)
+
+    elapsed = sum(latencies)
+    lat_ms = np.array(latencies) * 1000
+    return {
+        "docs": len(paths),
+        "pages": totals['pages'],
+        "blocks": totals['blocks'],
+        "candidates": totals['candidates'],
+        "seconds": round(elapsed, 4),
+        "pages_per_sec": round(totals['pages'] / elapsed, 3) if elapsed else 0.0,
+        "blocks_per_sec": round(totals['blocks'] / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(float(np.percentile(lat_ms, 50)), 2),
+            "p90": round(float(np.percentile(lat_ms, 90)), 2),
+            "p99": round(float(np.percentile(lat_ms, 99)), 2),
+            "max": round(float(lat_ms.max()), 2)
+        },
+        "start_rss_mb": round(start_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+def run_benchmark(args):
+    if args.tune_threads:
+        return {"thread_tuning": run_thread_tuning(args)}
+    models = load_models(Path(os.getenv('MODEL_DIR', 'app/models')))
+    if args.memory_scaling:
+        return {"memory_scaling": run_memory_scaling(args, models)}
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        "configs": {}
+    }
+    for lang in args.langs:
+        if lang not in AVAILABLE_LANGS:
+            print(f"Skipping {lang}: fonts not installed in fonts/")
+            continue
+        for layout in args.layouts:
+            for pages in args.pages:
+                paths = build_corpus(args.corpus_dir, pages, lang, layout, args.docs, args.seed)
+                for backend in args.backends:
+                    # The default backend keeps the plain config name so older results still compare.
+                    name = f"{lang}/{layout}/{pages}p" + (f"/{backend}" if backend != 'pdfplumber' else "")
+                    os.environ['PDF_BACKEND'] = backend
+                    result = run_config(paths, models)
+                    results["configs"][name] = result
+                    print(f"{name}: {result['pages_per_sec']} pages/s, {result['blocks_per_sec']} blocks/s, "
+                          f"p50 {result['latency_ms']['p50']} ms, peak RSS {result['peak_rss_mb']} MB")
+    return results
+
+# ─── Memory scaling ──────────────────────────────────────────────────────────
+def _run_in_child(conn, paths, models, env):
+    os.environ.update(env)
+    conn.send(run_config(paths, models))
+    conn.close()
+
+def run_isolated(paths, models, env):
+    """run_config in a forked child, so heap left over by earlier runs cannot hide its peak RSS."""
+    ctx = mp.get_context('fork')
+    receiver, sender = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_in_child, args=(sender, paths, models, env))
+    proc.start()
+    result = receiver.recv()
+    proc.join()
+    return result
+
+def run_memory_scaling(args, models):
+    """Peak RSS growth while processing one document, by page count, with and without LOW_MEMORY."""
+    models.preload(*PIPELINE_MODELS)
+    rows = []
+    for pages in args.pages:
+        paths = build_corpus(args.corpus_dir, pages, 'en', 'single', 1, args.seed)
+        row = {"pages": pages}
+        for mode, low_memory in (("default", "0"), ("low_memory", "1")):
+            result = run_isolated(paths, models, {"LOW_MEMORY": low_memory})
+            row[mode] = {"peak_growth_mb": round(result['peak_rss_mb'] - result['start_rss_mb'], 1),
+                         "pages_per_sec": result['pages_per_sec']}
+        rows.append(row)
+        print(f"{pages} pages: peak RSS growth {row['default']['peak_growth_mb']} MB default, "
+              f"{row['low_memory']['peak_growth_mb']} MB with LOW_MEMORY=1")
+    return rows
+
+# ─── Thread budget ───────────────────────────────────────────────────────────
+def _run_split(conn, tasks, model_dir, workers, threads):
+    conn.send(run_batch(tasks, model_dir, workers, incremental=False, threads=threads))
+    conn.close()
+
+def run_thread_tuning(args):
+    """Throughput of every workers x threads split of the cores; the fastest is saved.
+
+    Each split runs the whole batch driver over the synthetic corpus in a fresh
+    process, so no torch thread pool carries over from the previous split.
+    """
+    model_dir = Path(os.getenv('MODEL_DIR', 'app/models'))
+    paths = []
+    for lang in args.langs:
+        if lang not in AVAILABLE_LANGS:
+            print(f"Skipping {lang}: fonts not installed in fonts/")
+            continue
+        for layout in args.layouts:
+            for pages in args.pages:
+                paths.extend(build_corpus(args.corpus_dir, pages, lang, layout, args.docs, args.seed))
+    output_dir = Path(args.corpus_dir) / 'tune_output'
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [(str(path), str(output_dir / f"{path.stem}.json")) for path in paths]
+
+    cores = available_cores()
+    ctx = mp.get_context('fork')
+    rows = []
+    for workers, threads in candidate_splits(cores):
+        receiver, sender = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_run_split, args=(sender, tasks, model_dir, workers, threads))
+        proc.start()
+        sender.close()
+        try:
+            summary = receiver.recv()
+        except EOFError:
+            summary = None
+        proc.join()
+        if summary is None:
+            # The split's process died (e.g. OOM-killed) before reporting.
+            rows.append({"workers": workers, "threads": threads, "seconds": None,
+                         "pages_per_sec": None, "failed": len(tasks), "exitcode": proc.exitcode})
+            print(f"{workers} worker(s) x {threads} thread(s): died with exit code {proc.exitcode}")
+            continue
+        rows.append({"workers": workers, "threads": threads, "seconds": summary['seconds'],
+                     "pages_per_sec": summary['pages_per_sec'], "failed": summary['failed']})
+        print(f"{workers} worker(s) x {threads} thread(s): {summary['pages_per_sec']} pages/s")
+
+    succeeded = [row for row in rows if row['seconds'] is not None and not row['failed']]
+    if not succeeded:
+        print(f"No split processed the corpus without failures on {cores} core(s); "
+              f"{tuned_path()} left unchanged")
+        return {"cores": cores, "splits": rows, "best": None}
+    best = max(succeeded, key=lambda row: row['pages_per_sec'])
+    save_tuned(cores, best['workers'], best['threads'], pages_per_sec=best['pages_per_sec'])
+    print(f"Fastest on {cores} core(s): {best['workers']} worker(s) x {best['threads']} thread(s), "
+          f"saved to {tuned_path()}")
+    return {"cores": cores, "splits": rows, "best": best}
+
+# ─── Compare ─────────────────────────────────────────────────────────────────
+# (metric path, True if higher is better)
+COMPARED_METRICS = [
+    (("pages_per_sec",), True),
+    (("blocks_per_sec",), True),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p90"), False),
+    (("peak_rss_mb",), False),
+]
+
+def _metric(result, path):
+    for key in path:
+        result = result[key]
+    return result
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline` beyond the relative `tolerance`."""
+    regressions = []
+    for name, result in results.get("configs", {}).items():
+        base = baseline.get("configs", {}).get(name)
+        if base is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            new, old = _metric(result, path), _metric(base, path)
+            if not old:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{name} {'.'.join(path)}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark process_pdf on synthetic corpora.")
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--langs', nargs='+', default=['en', 'ja', 'ar', 'hi'], choices=list(LOCALES))
+    parser.add_argument('--layouts', nargs='+', default=['single', 'multi'], choices=['single', 'multi'])
+    parser.add_argument('--backends', nargs='+', default=['pdfplumber'], choices=BACKENDS,
+                        help="char extraction backends to run on every configuration")
+    parser.add_argument('--docs', type=int, default=3, help="documents per configuration")
+    parser.add_argument('--memory-scaling', action='store_true',
+                        help="only measure peak RSS against --pages, with and without LOW_MEMORY=1")
+    parser.add_argument('--tune-threads', action='store_true',
+                        help="time every workers x threads split of the cores on the corpus and save the fastest")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus-dir', default='bench_data')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help="flag regressions against a saved results file")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.tune_threads and results["thread_tuning"]["best"] is None:
+        sys.exit(1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
@@ -0,0 +1,94 @@
+# feature_store.py
+
+import os
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+
+class FeatureStore:
+    """Append-only float32 feature shards for train_model.py.
+
+    Every shard holds the feature rows (structural features followed by the
+    embedding) and labels of a run of consecutive synthetic documents.
+    meta.json is rewritten after each shard, so an interrupted build resumes at
+    the next document. A different `key` (embedder, seed, ...) starts afresh.
+    """
+
+    def __init__(self, path, key):
+        self.path = Path(path)
+        self.key = key
+        self.meta_path = self.path / 'meta.json'
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if meta is None or meta.get('key') != key:
+            if self.path.exists():
+                shutil.rmtree(self.path)
+            self.path.mkdir(parents=True)
+            meta = {'key': key, 'shards': []}
+        self.meta = meta
+        self._save()
+
+    def _save(self):
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    @property
+    def documents(self):
+        return sum(shard['documents'] for shard in self.meta['shards'])
+
+    @property
+    def rows(self):
+        return sum(shard['rows'] for shard in self.meta['shards'])
+
+    def append(self, features, y_head, y_level, documents):
+        """Store the rows of the next `documents` documents as a new shard."""
+        name = f"shard_{len(self.meta['shards']):05d}"
+        np.save(self.path / f"{name}_X.npy", np.asarray(features, dtype=np.float32))
+        np.save(self.path / f"{name}_head.npy", np.asarray(y_head, dtype=np.int8))
+        np.save(self.path / f"{name}_level.npy", np.asarray(y_level, dtype='U2'))
+        self.meta['shards'].append({'name': name, 'rows': len(features), 'documents': documents})
+        self._save()
+
+    def load(self, max_documents=None):
+        """(X, y_head, y_level) over the shards of the first `max_documents` documents.
+
+        X is a read-only memmap of the shards laid end to end; the combined
+        file is written once per shard count and reused by later retraining.
+        """
+        shards, covered = [], 0
+        for shard in self.meta['shards']:
+            if max_documents is not None and covered + shard['documents'] > max_documents:
+                break
+            shards.append(shard)
+            covered += shard['documents']
+        if not shards:
+            raise ValueError(f"feature store {self.path} is empty")
+
+        path = self.path / f"features_{len(shards)}.npy"
+        if not path.exists():
+            for stale in self.path.glob('features_*.npy'):
+                stale.unlink()
+            parts = [np.load(self.path / f"{s['name']}_X.npy", mmap_mode='r') for s in shards]
+            tmp_path = self.path / 'features.tmp.npy'
+            X = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(sum(len(p) for p in parts), parts[0].shape[1]))
+            start = 0
+            for part in parts:
+                X[start:start + len(part)] = part
+                start += len(part)
+            X.flush()
+            del X
+            os.replace(tmp_path, path)
+
+        X = np.load(path, mmap_mode='r')
+        y_head = np.concatenate([np.load(self.path / f"{s['name']}_head.npy") for s in shards])
+        y_level = np.concatenate([np.load(self.path / f"{s['name']}_level.npy") for s in shards])
+        return X, y_head.astype(int), y_level
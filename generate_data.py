@@ -1,10 +1,12 @@
 # generate_data.py
 
 import os
+import sys
 import random
-import re
+import time
+import zlib
+import multiprocessing as mp
 from pathlib import Path
-from collections import Counter, defaultdict
 
 import numpy as np
 import pdfplumber
@@ -20,19 +22,33 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from bidi.algorithm import get_display
 
+sys.path.insert(0, str(Path(__file__).parent / "app"))
+from main import collect_candidates
+from utils import structural_matrix
+
 # ─── Font Registration ────────────────────────────────────────────────────────
 FONT_DIR = Path(__file__).parent / "fonts"
 FONT_DIR.mkdir(exist_ok=True)
 
-# Register Noto Sans fonts for each language
-pdfmetrics.registerFont(TTFont("NotoSans", str(FONT_DIR / "NotoSans-Regular.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-Bold", str(FONT_DIR / "NotoSans-Bold.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-JP", str(FONT_DIR / "NotoSansJP-Regular.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-JP-Bold", str(FONT_DIR / "NotoSansJP-Bold.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-Arabic", str(FONT_DIR / "NotoSansArabic-Regular.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-Arabic-Bold", str(FONT_DIR / "NotoSansArabic-Bold.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-Devanagari", str(FONT_DIR / "NotoSansDevanagari-Regular.ttf")))
-pdfmetrics.registerFont(TTFont("NotoSans-Devanagari-Bold", str(FONT_DIR / "NotoSansDevanagari-Bold.ttf")))
+# Register Noto Sans fonts for each language (missing files are skipped)
+def register_font(name, filename):
+    path = FONT_DIR / filename
+    if not path.exists():
+        return False
+    pdfmetrics.registerFont(TTFont(name, str(path)))
+    return True
+
+FONT_FILES = {
+    "NotoSans": "NotoSans-Regular.ttf",
+    "NotoSans-Bold": "NotoSans-Bold.ttf",
+    "NotoSans-JP": "NotoSansJP-Regular.ttf",
+    "NotoSans-JP-Bold": "NotoSansJP-Bold.ttf",
+    "NotoSans-Arabic": "NotoSansArabic-Regular.ttf",
+    "NotoSans-Arabic-Bold": "NotoSansArabic-Bold.ttf",
+    "NotoSans-Devanagari": "NotoSansDevanagari-Regular.ttf",
+    "NotoSans-Devanagari-Bold": "NotoSansDevanagari-Bold.ttf",
+}
+REGISTERED_FONTS = {name for name, filename in FONT_FILES.items() if register_font(name, filename)}
 
 # Language to font mapping
 LANG_FONTS = {
@@ -41,6 +57,7 @@ LANG_FONTS = {
     'ar': ('NotoSans-Arabic', 'NotoSans-Arabic-Bold'),
     'hi': ('NotoSans-Devanagari', 'NotoSans-Devanagari-Bold')
 }
+AVAILABLE_LANGS = [lang for lang, fonts in LANG_FONTS.items() if set(fonts) <= REGISTERED_FONTS]
 
 # ─── Output Directory ────────────────────────────────────────────────────────
 PDF_DIR = Path("pdf_data")
@@ -116,171 +133,134 @@ def generate_pdf(path, elements, page_size, layout, lang):
     doc.build(elements)
 
 # ─── Process PDF for Training ────────────────────────────────────────────────
+# Structural feature columns, as computed by structural_matrix.
+STRUCT_KEYS = ['size_ratio', 'position_x', 'position_y', 'centered', 'length', 'case_ratio',
+               'digit_ratio', 'punct_present', 'prev_line_distance', 'next_line_size_ratio']
+# Bump when what a sample is changes, so feature stores are rebuilt.
+SAMPLE_VERSION = 2
+
 def process_pdf_for_training(pdf_path, true_headings):
-    """Extract training samples from PDF given ground-truth headings."""
-    spans = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for pnum, page in enumerate(pdf.pages, 1):
-            for ch in page.chars:
-                spans.append({
-                    'text': ch['text'],
-                    'size': round(ch['size'], 1),
-                    'x0': ch['x0'],
-                    'x1': ch['x1'],
-                    'top': ch['top'],
-                    'bottom': ch['bottom'],
-                    'page': pnum
-                })
-
-    # Body font size (fallback to 11 if empty)
-    body_size = Counter(s['size'] for s in spans).most_common(1)[0][0] if spans else 11
-
-    # Group into lines
-    lines = defaultdict(list)
-    for s in spans:
-        key = round(s['top'], 1)
-        lines[key].append(s)
-
-    # Create text blocks
-    blocks = []
-    for y, chars in lines.items():
-        chars.sort(key=lambda c: c['x0'])
-        text = ''.join(c['text'] for c in chars)
-        sizes = [c['size'] for c in chars]
-        blocks.append({
-            'text': text,
-            'size': max(sizes),
-            'x0': min(c['x0'] for c in chars),
-            'x1': max(c['x1'] for c in chars),
-            'top': min(c['top'] for c in chars),
-            'bottom': max(c['bottom'] for c in chars),
-            'page': chars[0]['page']
-        })
-
-    # Sort and merge blocks
-    blocks.sort(key=lambda b: (b['page'], b['top'], b['x0']))
-    merged = []
-    i = 0
-    while i < len(blocks):
-        cur = blocks[i].copy()
-        j = i + 1
-        while j < len(blocks) and \
-              abs(blocks[j]['size'] - cur['size']) < 0.1 and \
-              blocks[j]['top'] - cur['bottom'] < 5 * cur['size']:
-            cur['text'] += ' ' + blocks[j]['text']
-            cur['bottom'] = blocks[j]['bottom']
-            cur['x1'] = max(cur['x1'], blocks[j]['x1'])
-            j += 1
-        merged.append(cur)
-        i = j
+    """Extract training samples from PDF given ground-truth headings.
 
-    samples, y_h, y_l = [], [], []
-    
-    # Get page dimensions
+    Samples are the candidate blocks the extractor itself would classify
+    (same line grouping, merging, filters and title exclusion), with the
+    features of structural_matrix, so the models and the cascade thresholds
+    calibrated on them see exactly what they see at inference.
+    """
     with pdfplumber.open(pdf_path) as pdf:
-        dims = [(p.width, p.height) for p in pdf.pages]
+        _, body_size, candidates = collect_candidates(pdf)
+    features = structural_matrix(candidates, body_size) if candidates else []
 
-    for idx, blk in enumerate(merged):
+    # (page, text) -> level; the first ground-truth heading wins on duplicates
+    truth_levels = {}
+    for th in true_headings:
+        truth_levels.setdefault((th['page'], th['text'].strip()), th['level'])
+
+    samples, y_h, y_l = [], [], []
+    for candidate, row in zip(candidates, features):
+        text = candidate['block']['text']
         # Label: 0=not heading, 1=heading
-        lbl = 0
-        lvl = ''
-        for th in true_headings:
-            if th['page'] == blk['page'] and th['text'].strip() == blk['text'].strip():
-                lbl = 1
-                lvl = th['level']
-                break
-        
-        # Skip long non-heading blocks
-        if not lbl and len(blk['text']) > 150:
-            continue
-
-        # Calculate features
-        w, h = dims[blk['page'] - 1]
-        px = (blk['x0'] + blk['x1']) / 2 / w
-        py = blk['top'] / h
-        centered = int(0.4 < px < 0.6)
-        length = len(blk['text'])
-        case_ratio = sum(c.isupper() for c in blk['text']) / max(1, length)
-        digit_ratio = sum(c.isdigit() for c in blk['text']) / max(1, length)
-        punct = int(bool(re.search(r'[.,;:!?\-]', blk['text'])))
-        prev_blk = merged[idx - 1] if idx > 0 else None
-        next_blk = merged[idx + 1] if idx < len(merged) - 1 else None
-        prev_dist = blk['top'] - (prev_blk or blk)['bottom'] if prev_blk else 0
-        next_ratio = (next_blk['size'] / body_size) if next_blk else 0
-
-        samples.append({
-            'text': blk['text'],
-            'size_ratio': blk['size'] / body_size,
-            'position_x': px,
-            'position_y': py,
-            'centered': centered,
-            'length': length,
-            'case_ratio': case_ratio,
-            'digit_ratio': digit_ratio,
-            'punct_present': punct,
-            'prev_line_distance': prev_dist,
-            'next_line_size_ratio': next_ratio
-        })
-        y_h.append(lbl)
+        lvl = truth_levels.get((candidate['page'], text.strip()), '')
+        samples.append({'text': text, **dict(zip(STRUCT_KEYS, row.tolist()))})
+        y_h.append(int(bool(lvl)))
         y_l.append(lvl)
 
     return {'samples': samples, 'is_heading': y_h, 'heading_level': y_l}
 
 # ─── Generate Dataset ────────────────────────────────────────────────────────
-def generate_dataset(n_samples=200):
-    X, y_head, y_level = [], [], []
+def document_seed(seed, i):
+    """Seed of document `i`; independent of which worker builds it."""
+    return zlib.crc32(f"{seed}:{i}".encode())
+
+def build_training_document(i, seed=0):
+    """Render synthetic document `i`, extract its labelled samples and delete it."""
+    doc_seed = document_seed(seed, i)
+    rng = random.Random(doc_seed)
+
+    # Choose document language
+    loc = rng.choice([lang for lang in fakers if lang in AVAILABLE_LANGS])
+    fake = fakers[loc]
+    fake.seed_instance(doc_seed)
+
+    # Document properties
+    layout = rng.choice(['single', 'multi'])
+    page_sz = rng.choice([letter, A4])
+    pdf_path = PDF_DIR / f"doc_{i}_{loc}_{layout}.pdf"
+
+    elems, truths = [], []
+
+    # Title (H1)
+    title = fake.sentence(nb_words=rng.randint(2, 6))
+    elems.append(make_paragraph(title, rng.choice([26, 28, 30]), lang=loc, bold=True, align=1))
+    elems.append(Spacer(1, 20))
+    truths.append({'page': 1, 'text': title, 'level': 'H1'})
+
+    # Content pages
+    num_pages = rng.randint(2, 4)
+    for p in range(num_pages):
+        if layout == 'multi':
+            elems.append(FrameBreak())
 
-    for i in range(n_samples):
-        # Choose document language
-        loc = random.choice(list(fakers.keys()))
-        fake = fakers[loc]
-        
-        # Document properties
-        layout = random.choice(['single', 'multi'])
-        page_sz = random.choice([letter, A4])
-        pdf_path = PDF_DIR / f"doc_{i}_{loc}_{layout}.pdf"
-
-        elems, truths = [], []
-
-        # Title (H1)
-        title = fake.sentence(nb_words=random.randint(2, 6))
-        elems.append(make_paragraph(title, random.choice([26, 28, 30]), lang=loc, bold=True, align=1))
-        elems.append(Spacer(1, 20))
-        truths.append({'page': 1, 'text': title, 'level': 'H1'})
-
-        # Content pages
-        num_pages = random.randint(2, 4)
-        for p in range(num_pages):
-            if layout == 'multi':
-                elems.append(FrameBreak())
-
-            # Headings (H2/H3)
-            for lvl, sizes in [('H2', [18, 20, 22]), ('H3', [14, 16, 18])]:
-                if random.random() < 0.5:
-                    htxt = fake.sentence(nb_words=random.randint(2, 6))
-                    elems.append(make_paragraph(htxt, random.choice(sizes), lang=loc, bold=True))
-                    elems.append(Spacer(1, 12))
-                    truths.append({'page': p + 1, 'text': htxt, 'level': lvl})
-
-            # Body paragraphs
-            for _ in range(random.randint(2, 5)):
-                btxt = fake.paragraph(nb_sentences=3)
-                elems.append(make_paragraph(btxt, 11, lang=loc))
-                elems.append(Spacer(1, 8))
-
-            if p < num_pages - 1:
-                elems.append(PageBreak())
-
-        # Build PDF
-        generate_pdf(pdf_path, elems, page_sz, layout, loc)
-
-        # Extract features
-        feats = process_pdf_for_training(str(pdf_path), truths)
-        X.extend(feats['samples'])
-        y_head.extend(feats['is_heading'])
-        y_level.extend(feats['heading_level'])
-        os.remove(pdf_path)
+        # Headings (H2/H3)
+        for lvl, sizes in [('H2', [18, 20, 22]), ('H3', [14, 16, 18])]:
+            if rng.random() < 0.5:
+                htxt = fake.sentence(nb_words=rng.randint(2, 6))
+                elems.append(make_paragraph(htxt, rng.choice(sizes), lang=loc, bold=True))
+                elems.append(Spacer(1, 12))
+                truths.append({'page': p + 1, 'text': htxt, 'level': lvl})
+
+        # Body paragraphs
+        for _ in range(rng.randint(2, 5)):
+            btxt = fake.paragraph(nb_sentences=3)
+            elems.append(make_paragraph(btxt, 11, lang=loc))
+            elems.append(Spacer(1, 8))
+
+        if p < num_pages - 1:
+            elems.append(PageBreak())
+
+    # Build PDF
+    generate_pdf(pdf_path, elems, page_sz, layout, loc)
+
+    # Extract features
+    feats = process_pdf_for_training(str(pdf_path), truths)
+    os.remove(pdf_path)
+    return feats
+
+def _build_training_document(args):
+    return build_training_document(*args)
 
+def generate_dataset(n_samples=200, workers=None, seed=0, start=0):
+    """Samples of `n_samples` synthetic documents rendered on `workers` processes.
+
+    Documents are numbered from `start`, so a dataset can be built in chunks.
+
+    Every document has its own seed derived from `seed`, and results are
+    collected in document order, so the dataset does not depend on `workers`.
+    """
+    workers = workers or os.cpu_count() or 1
+    X, y_head, y_level = [], [], []
+
+    started = time.perf_counter()
+    jobs = [(i, seed) for i in range(start, start + n_samples)]
+    if workers <= 1:
+        results = map(_build_training_document, jobs)
+        pool = None
+    else:
+        pool = mp.get_context().Pool(workers)
+        results = pool.imap(_build_training_document, jobs, chunksize=4)
+    try:
+        for feats in results:
+            X.extend(feats['samples'])
+            y_head.extend(feats['is_heading'])
+            y_level.extend(feats['heading_level'])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - started
+    print(f"Generated {n_samples} documents in {elapsed:.1f}s "
+          f"({n_samples / elapsed if elapsed else 0.0:.2f} docs/s, {workers} worker(s))")
     return X, np.array(y_head), np.array(y_level)
 
 if __name__ == '__main__':
@@ -1,41 +1,81 @@
 import os
+import json
+import time
 import joblib
 import numpy as np
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 from sklearn.decomposition import PCA
 from sklearn.ensemble import RandomForestClassifier
-from generate_data import generate_dataset
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+from generate_data import STRUCT_KEYS, SAMPLE_VERSION, generate_dataset
+from feature_store import FeatureStore
+from app.compiled import export_bundle, Bundle, verify_forest
+from app.static_embedding import distill_static
 import shutil
 
-def train():
-    # Multilingual MiniLM
-    embedder = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-    
-    X, y_head, y_level = generate_dataset(2000)
-    print(f"Total samples: {len(X)}, headings: {sum(y_head)}")
-
-
-    # Build feature matrix
-    feats = []
-    for sample in tqdm(X, desc="Extracting..."):
-        # Build structural features from sample keys:
-        struct = [
-            sample['size_ratio'],
-            sample['position_x'],
-            sample['position_y'],
-            sample['centered'],
-            sample['length'],
-            sample['case_ratio'],
-            sample['digit_ratio'],
-            sample['punct_present'],
-            sample['prev_line_distance'],
-            sample['next_line_size_ratio'],
-        ]
-        # Get embedding
-        emb = embedder.encode([sample['text']])[0]
-        feats.append(struct + emb.tolist())
-    X_mat = np.array(feats)
+N_STRUCT = 10
+
+def confident_threshold(proba, y, target):
+    """Lowest threshold t such that samples with proba >= t reach `target` precision."""
+    order = np.argsort(-proba, kind='stable')
+    p, yy = proba[order], y[order]
+    precision = np.cumsum(yy) / np.arange(1, len(yy) + 1)
+    # Only cut between distinct probabilities so ties land on the same side.
+    boundary = np.r_[p[1:] != p[:-1], True]
+    ok = np.flatnonzero((precision >= target) & boundary)
+    return float(p[ok[-1]]) if len(ok) else np.inf
+
+def fit_structural_cascade(X_struct, y_head, target=0.99):
+    """Small forest on the structural features with confidence thresholds.
+
+    Blocks with proba >= high are headings and proba <= low are body text at
+    `target` precision on a held-out split; the rest go to the embedding path.
+    """
+    X_tr, X_val, y_tr, y_val = train_test_split(
+        X_struct, y_head, test_size=0.2, random_state=42, stratify=y_head)
+    rf = RandomForestClassifier(n_estimators=30, max_depth=8,
+                                class_weight='balanced', random_state=42)
+    rf.fit(X_tr, y_tr)
+
+    proba = rf.predict_proba(X_val)[:, 1]
+    high = confident_threshold(proba, y_val, target)
+    low = -confident_threshold(-proba, 1 - y_val, target)
+    if low >= high:
+        low = -np.inf
+
+    settled = np.mean((proba >= high) | (proba <= low))
+    print(f"Structural cascade: low={low:.3f} high={high:.3f}, settles {settled:.1%} of held-out blocks")
+    return {'model': rf, 'low': low, 'high': high}
+
+EMBEDDER = 'sentence-transformers/all-MiniLM-L6-v2'
+STATIC_DIR = 'app/models/static'
+
+def featurize(samples, embedder, batch_size=256):
+    """float32 rows of structural features followed by the batch-encoded embedding."""
+    dim = N_STRUCT + embedder.get_sentence_embedding_dimension()
+    features = np.empty((len(samples), dim), dtype=np.float32)
+    if samples:
+        features[:, :N_STRUCT] = [[sample[key] for key in STRUCT_KEYS] for sample in samples]
+        features[:, N_STRUCT:] = embedder.encode([sample['text'] for sample in samples],
+                                                 batch_size=batch_size)
+    return features
+
+def build_feature_store(store, embedder, n_docs, chunk_docs=100, workers=None, seed=0):
+    """Render, label and embed documents until the store covers `n_docs` of them."""
+    with tqdm(total=n_docs, initial=min(store.documents, n_docs), desc="Feature store") as progress:
+        while store.documents < n_docs:
+            count = min(chunk_docs, n_docs - store.documents)
+            X, y_head, y_level = generate_dataset(count, workers, seed, start=store.documents)
+            store.append(featurize(X, embedder), y_head, y_level, count)
+            progress.update(count)
+
+def fit_models(X_mat, y_head, y_level):
+    """(cascade, pca, rf_head, rf_lvl) fitted on the stored feature rows."""
+    # Structural-only first stage of the inference cascade
+    cascade = fit_structural_cascade(X_mat[:, :N_STRUCT], y_head)
+
     pca = PCA(n_components=50, random_state=42)
     X_pca = pca.fit_transform(X_mat)
 
@@ -48,15 +88,108 @@ def train():
     idx = np.where(y_head==1)[0]
     rf_lvl = RandomForestClassifier(n_estimators=100, max_depth=15, random_state=42)
     rf_lvl.fit(X_pca[idx], np.array(y_level)[idx])
+    return cascade, pca, rf_head, rf_lvl
+
+def save_models(model_dir, X_mat, y_head, cascade, pca, rf_head, rf_lvl):
+    os.makedirs(model_dir, exist_ok=True)
+    joblib.dump(pca, os.path.join(model_dir, 'pca.pkl'))
+    joblib.dump(rf_head, os.path.join(model_dir, 'classifier_head.pkl'))
+    joblib.dump(rf_lvl, os.path.join(model_dir, 'classifier_level.pkl'))
+    joblib.dump(cascade, os.path.join(model_dir, 'classifier_struct.pkl'))
+    # Same models as plain .npy arrays for fast, sklearn-free loading
+    bundle_dir = os.path.join(model_dir, 'bundle')
+    export_bundle(bundle_dir, pca, {'classifier_head': rf_head, 'classifier_level': rf_lvl}, cascade)
+    # The compiled forests must make exactly the same decisions as sklearn
+    bundle = Bundle(bundle_dir)
+    X_pca = pca.transform(X_mat)
+    idx = np.where(y_head==1)[0]
+    verify_forest(bundle.forest('classifier_head'), rf_head, X_pca)
+    verify_forest(bundle.forest('classifier_level'), rf_lvl, X_pca[idx])
+    verify_forest(bundle.forest('classifier_struct'), cascade['model'], X_mat[:, :N_STRUCT])
+
+def evaluate_embedder(embedder, pca, rf_head, samples, y_head):
+    """Embedding throughput and classifier_head F1 on held-out samples."""
+    start = time.perf_counter()
+    features = featurize(samples, embedder)
+    elapsed = time.perf_counter() - start
+    predicted = rf_head.predict(pca.transform(features))
+    return {
+        "texts_per_sec": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "heading_f1": round(float(f1_score(y_head, predicted)), 4)
+    }
+
+def train_static(embedder, minilm_models, n_docs, store_dir, workers=None, seed=0, eval_docs=200):
+    """Distill `embedder` into a static token table and retrain the models on it.
+
+    Writes the table, tokenizer and models to STATIC_DIR ($EMBEDDING=static)
+    and compares throughput and heading F1 with the MiniLM path on `eval_docs`
+    generated documents that neither was trained on.
+    """
+    static = distill_static(embedder, STATIC_DIR)
+    store = FeatureStore(store_dir, {'embedder': 'static:' + EMBEDDER, 'seed': seed, 'struct': STRUCT_KEYS,
+                                     'samples': SAMPLE_VERSION})
+    build_feature_store(store, static, n_docs, workers=workers, seed=seed)
+    X_mat, y_head, y_level = store.load(n_docs)
+    static_models = fit_models(X_mat, y_head, y_level)
+    save_models(STATIC_DIR, X_mat, y_head, *static_models)
+
+    samples, y_eval, _ = generate_dataset(eval_docs, workers, seed, start=n_docs)
+    y_eval = np.asarray(y_eval, dtype=int)
+    report = {
+        "eval_docs": eval_docs,
+        "eval_samples": len(samples),
+        "minilm": evaluate_embedder(embedder, minilm_models[1], minilm_models[2], samples, y_eval),
+        "static": evaluate_embedder(static, static_models[1], static_models[2], samples, y_eval)
+    }
+    with open(os.path.join(STATIC_DIR, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    for name in ('minilm', 'static'):
+        print(f"{name}: {report[name]['texts_per_sec']} texts/s, heading F1 {report[name]['heading_f1']}")
+    return report
+
+def train(n_docs=2000, store_dir='feature_store', workers=None, seed=0, rebuild=False, static=False,
+          eval_docs=200):
+    # Multilingual MiniLM
+    embedder = SentenceTransformer(EMBEDDER)
+
+    # Features are stored on disk, so retraining reuses them without
+    # re-rendering or re-embedding; `rebuild` starts the store over.
+    static_store_dir = f"{store_dir.rstrip(os.sep)}_static"
+    if rebuild:
+        for path in (store_dir, static_store_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+    store = FeatureStore(store_dir, {'embedder': EMBEDDER, 'seed': seed, 'struct': STRUCT_KEYS,
+                                     'samples': SAMPLE_VERSION})
+    build_feature_store(store, embedder, n_docs, workers=workers, seed=seed)
+    X_mat, y_head, y_level = store.load(n_docs)
+    print(f"Total samples: {len(X_mat)}, headings: {sum(y_head)}")
+
+    models = fit_models(X_mat, y_head, y_level)
 
     # Save
     os.makedirs('app/models', exist_ok=True)
     embedder.save('app/models/minilm')
-    joblib.dump(pca, 'app/models/pca.pkl')
-    joblib.dump(rf_head, 'app/models/classifier_head.pkl')
-    joblib.dump(rf_lvl, 'app/models/classifier_level.pkl')
+    save_models('app/models', X_mat, y_head, *models)
+
+    if static:
+        train_static(embedder, models, n_docs, static_store_dir, workers, seed, eval_docs)
     print("Training complete!")
 
 if __name__ == '__main__':
-    train()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the heading models on synthetic documents.")
+    parser.add_argument('--docs', type=int, default=2000, help="synthetic documents to train on")
+    parser.add_argument('--store', default='feature_store', help="on-disk feature store directory")
+    parser.add_argument('--workers', type=int, help="document rendering processes (default: CPU count)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rebuild', action='store_true', help="discard the stored features first")
+    parser.add_argument('--static', action='store_true',
+                        help="also distill MiniLM into the static-embedding fast mode and report its F1")
+    parser.add_argument('--eval-docs', type=int, default=200,
+                        help="held-out documents for the --static throughput/F1 report")
+    args = parser.parse_args()
+
+    train(args.docs, args.store, args.workers, args.seed, args.rebuild, args.static, args.eval_docs)
 